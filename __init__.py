@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 19:39:55 2026
+
+Utilities for micrometeorological data processing. Submodules are imported
+on first access, and their heavy dependencies on first use.
+"""
+
+import importlib
+
+__all__ = ['archive_and_compress', 'file_discovery', 'footprint_utils',
+           'get_instrument_diagnostic', 'gis_utils', 'instrumentation',
+           'machine_learning_utils', 'netcdf_utils', 'plot_utils']
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
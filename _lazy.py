@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 19:39:55 2026
+
+Lazy import of the heavy dependencies (matplotlib, scipy, sklearn,
+rasterio, geopandas, etc.) so that importing the utilities is fast and
+dependencies are only loaded by the functions that use them.
+"""
+
+import importlib
+
+
+class LazyModule():
+    """
+    Placeholder for a module that is imported on first attribute access.
+
+    Parameters
+    ----------
+    name : String
+        Full name of the module, for example 'matplotlib.pyplot'
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f'<lazy module {self._name} ({state})>'
+
+
+def lazy_import(name):
+    """
+    Import a module lazily.
+
+    Parameters
+    ----------
+    name : String
+        Full name of the module
+
+    Returns
+    -------
+    module : LazyModule
+    """
+    return LazyModule(name)
+
+
+def force_load(*modules):
+    """
+    Import lazy modules now, for example before timing code that uses them.
+
+    Parameters
+    ----------
+    *modules : LazyModule or module
+        Modules to load. Modules that are already imported are ignored.
+    """
+    for module in modules:
+        if isinstance(module, LazyModule) and module._module is None:
+            module._module = importlib.import_module(module._name)
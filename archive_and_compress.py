@@ -5,15 +5,26 @@ Created on Thu Aug 17 12:00:18 2023
 
 Script to archive and compress repositories.
 Perform a source-destination comparison to perform operation only on new files.
-Can filter specific folders by specifying the matching file. See pathlib.Path.glob doc for more details
+Can filter specific folders by specifying the matching file. See fnmatch doc for more details
 Destination can be overwritten if overwrite is set to True
 To ommit compression (perform a simple copy) add the name of the file in the copy_only list
+
+Usage:
+    python archive_and_compress.py main_directory tar_directory [--overwrite]
 """
 
+import argparse
 import tarfile
 import shutil
 from pathlib import Path
 
+try:
+    from .file_discovery import list_directory, scan_directories
+    from .instrumentation import instrument
+except ImportError:
+    from file_discovery import list_directory, scan_directories
+    from instrumentation import instrument
+
 main_directory ='E:/Ro2_micromet_raw_data/Data'
 tar_directory = 'E:/Ro2_micromet_raw_data/Tar_for_Beluga'
 matching_files = '*'
@@ -21,36 +32,91 @@ overwrite = False
 copy_only = ['date_verification.xlsx']
 
 
+@instrument()
 def make_tarfile(source_folder, output_filename):
     with tarfile.open(output_filename, "w:gz") as tar:
         tar.add(source_folder, arcname='')
 
-# Manage path
-main_directory = Path(main_directory)
-tar_directory = Path(tar_directory)
-list_field_collection = main_directory.glob(matching_files)
-
-for i_field_collection in list_field_collection:
+@instrument()
+def archive_directories(main_directory, tar_directory, matching_files='*',
+                        overwrite=False, copy_only=[]):
+    """
+    Archive and compress each station folder of each field collection of
+    main_directory into tar_directory.
 
-    # If current file/folder in copy_only, simply copy
-    if i_field_collection.name == copy_only:
-        shutil.copyfile(i_field_collection, Path.joinpath(tar_directory, i_field_collection.name) )
-        continue
+    Parameters
+    ----------
+    main_directory : String or Pathlib Path
+        Directory containing the field collections
+    tar_directory : String or Pathlib Path
+        Destination directory
+    matching_files : String, optional
+        Pattern of the names of the field collections to process (see
+        fnmatch). The default is '*'.
+    overwrite : Bool, optional
+        Overwrite existing archives. The default is False.
+    copy_only : List of String, optional
+        Names of the files that are copied without compression. The default
+        is [].
+    """
+    # Manage path
+    main_directory = Path(main_directory)
+    tar_directory = Path(tar_directory)
+    list_field_collection = [main_directory.joinpath(name)
+                             for name in list_directory(main_directory, matching_files)]
 
-    # Create the corresponding folder in the parent destination directory
-    if not Path.joinpath(tar_directory, i_field_collection.stem).is_dir():
-        Path.mkdir( Path.joinpath(tar_directory, i_field_collection.stem))
+    # List the stations and the existing archives of all field collections at once
+    collections = [c for c in list_field_collection if c.name not in copy_only]
+    stations = scan_directories(collections)
+    archives = scan_directories([tar_directory.joinpath(c.stem) for c in collections],
+                                subdirectories=False)
 
-    for station in i_field_collection.glob('*'):
-        archive_name = Path.joinpath(tar_directory, i_field_collection.stem, station.stem).with_suffix('.tar.gz')
+    for i_field_collection in list_field_collection:
 
-        if not archive_name.is_file():
-            print(f'Start compressing "{station}"')
-            make_tarfile(station, archive_name)
-            print(f'"{station}" has been archived and compressed in "{archive_name}"')
+        # If current file/folder in copy_only, simply copy
+        if i_field_collection.name in copy_only:
+            shutil.copyfile(i_field_collection, Path.joinpath(tar_directory, i_field_collection.name) )
             continue
 
-        if overwrite == True:
-            print(f'Start compressing "{station}"')
-            make_tarfile(station, archive_name)
-            print(f'"{station}" has been archived and compressed in "{archive_name}"')
\ No newline at end of file
+        # Create the corresponding folder in the parent destination directory
+        if not Path.joinpath(tar_directory, i_field_collection.stem).is_dir():
+            Path.mkdir( Path.joinpath(tar_directory, i_field_collection.stem))
+
+        existing_archives = archives[tar_directory.joinpath(i_field_collection.stem)]
+        for station in stations[i_field_collection]:
+            station = i_field_collection.joinpath(station)
+            archive_name = Path.joinpath(tar_directory, i_field_collection.stem, station.stem).with_suffix('.tar.gz')
+
+            if archive_name.name not in existing_archives:
+                print(f'Start compressing "{station}"')
+                make_tarfile(station, archive_name)
+                print(f'"{station}" has been archived and compressed in "{archive_name}"')
+                continue
+
+            if overwrite == True:
+                print(f'Start compressing "{station}"')
+                make_tarfile(station, archive_name)
+                print(f'"{station}" has been archived and compressed in "{archive_name}"')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Archive and compress station folders.')
+    parser.add_argument('main_directory', nargs='?', default=main_directory,
+                        help='Directory containing the field collections')
+    parser.add_argument('tar_directory', nargs='?', default=tar_directory,
+                        help='Destination directory')
+    parser.add_argument('--matching-files', default=matching_files,
+                        help='Pattern of the field collections to process')
+    parser.add_argument('--overwrite', action='store_true', default=overwrite,
+                        help='Overwrite existing archives')
+    parser.add_argument('--copy-only', nargs='*', default=copy_only,
+                        help='Files copied without compression')
+    args = parser.parse_args()
+
+    archive_directories(args.main_directory, args.tar_directory,
+                        args.matching_files, args.overwrite, args.copy_only)
+
+
+if __name__ == '__main__':
+    main()
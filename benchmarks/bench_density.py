@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 19:29:32 2026
+
+Compare the speed and the accuracy of the point density methods used by
+plot_utils.density_scatter_plot. Accuracy is measured against the exact
+gaussian KDE, which is only computed for the smallest sizes.
+"""
+
+import sys
+import time
+from pathlib import Path
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import plot_utils
+
+sizes = [1_000, 10_000, 100_000, 1_000_000]
+max_kde_size = 10_000
+max_knn_size = 100_000
+methods = ['kde', 'hist', 'knn']
+
+
+def make_data(n, seed=42):
+    rng = np.random.default_rng(seed)
+    x = rng.normal(size=n)
+    y = 0.8 * x + rng.gamma(2, 0.3, size=n)
+    return x, y
+
+
+def main():
+    print(f'{"n":>10} {"method":>6} {"time (s)":>10} {"corr":>6} {"rel. err":>9}')
+    for n in sizes:
+        x, y = make_data(n)
+        z_ref = None
+        for method in methods:
+            if (method == 'kde' and n > max_kde_size) or \
+                    (method == 'knn' and n > max_knn_size):
+                continue
+            t0 = time.perf_counter()
+            z = plot_utils.point_density(x, y, method=method)
+            elapsed = time.perf_counter() - t0
+            if method == 'kde':
+                z_ref = z
+            if z_ref is None:
+                corr, err = np.nan, np.nan
+            else:
+                corr = np.corrcoef(z, z_ref)[0,1]
+                err = np.median(np.abs(z - z_ref) / z_ref)
+            print(f'{n:>10} {method:>6} {elapsed:>10.3f} {corr:>6.3f} {err:>9.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 19:39:55 2026
+
+Measure the time needed to import each module of the utilities in a fresh
+interpreter (best of several runs), compared to an empty interpreter start.
+Use python -X importtime -c "import plot_utils" for the detail of a module.
+"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+root = Path(__file__).resolve().parents[1]
+modules = ['archive_and_compress', 'footprint_utils', 'get_instrument_diagnostic',
+           'gis_utils', 'machine_learning_utils', 'netcdf_utils', 'plot_utils']
+repeat = 5
+
+code = ('import time; t0 = time.perf_counter(); import {module}; '
+        'print(time.perf_counter() - t0)')
+
+
+def import_time(module):
+    """ Best import time of module (s) over repeat fresh interpreters."""
+    times = []
+    for i in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code.format(module=module)],
+                             cwd=root, capture_output=True, text=True, check=True)
+        times.append(float(out.stdout.split()[-1]))
+    return min(times)
+
+
+if __name__ == '__main__':
+    print(f'{"module":<30} {"import time (ms)":>16}')
+    for module in modules:
+        print(f'{module:<30} {import_time(module) * 1000:>16.1f}')
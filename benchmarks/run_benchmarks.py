@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 19:37:16 2026
+
+Benchmarks of the hot paths of the utilities on synthetic data (see
+synthetic_data.py). For each benchmark and data size, the best wall time
+over several repeats and the peak memory allocated (tracemalloc) are
+recorded. Results can be saved as a baseline and compared to it.
+
+Usage:
+    python benchmarks/run_benchmarks.py --save          # record a baseline
+    python benchmarks/run_benchmarks.py --compare       # compare to it
+    python benchmarks/run_benchmarks.py -k raster -q    # subset, small sizes
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import numpy as np
+
+import matplotlib
+matplotlib.use('Agg')
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import synthetic_data
+
+default_baseline = Path(__file__).resolve().parent.joinpath('baseline.json')
+
+
+### Benchmarks ###
+# Each benchmark takes a data size and a temporary directory, creates its
+# data and returns the function to time.
+
+def bench_density_scatter_plot(size, tmp):
+    import matplotlib.pyplot as plt
+    import plot_utils
+    rng = np.random.default_rng(42)
+    x = rng.normal(size=size)
+    y = x + rng.normal(size=size)
+    def run():
+        fig, ax = plt.subplots()
+        plot_utils.density_scatter_plot(x, y, ax=ax, density='hist')
+        plt.close(fig)
+    return run
+
+
+def bench_density_kde(size, tmp):
+    import plot_utils
+    rng = np.random.default_rng(42)
+    x = rng.normal(size=size)
+    y = x + rng.normal(size=size)
+    return lambda: plot_utils.point_density(x, y, method='kde')
+
+
+def bench_binned_statistics(size, tmp):
+    import plot_utils
+    rng = np.random.default_rng(42)
+    x = rng.normal(size=size)
+    y = x + rng.normal(size=size)
+    return lambda: plot_utils.binned_statistics(x, y, n_bins=20, quantiles=(5,25,75,95))
+
+
+def bench_get_raster_hist(size, tmp):
+    import gis_utils
+    raster = synthetic_data.make_geotiff(tmp.joinpath('raster.tif'),
+                                         width=size, height=size, count=1)
+    return lambda: gis_utils.get_raster_hist(raster, bins=50)
+
+
+def bench_get_shapefile_extent(size, tmp):
+    import gis_utils
+    shapefile = synthetic_data.make_shapefile(tmp.joinpath('shape.shp'), size)
+    return lambda: gis_utils.get_shapefile_extent(shapefile)
+
+
+def bench_train_rf(size, tmp):
+    import machine_learning_utils
+    rng = np.random.default_rng(42)
+    X = rng.normal(size=(size, 5))
+    y = X @ np.arange(1, 6) + rng.normal(size=size)
+    return lambda: machine_learning_utils.train_rf(y, X)
+
+
+def bench_predict_rf(size, tmp):
+    import machine_learning_utils
+    rng = np.random.default_rng(42)
+    X = rng.normal(size=(10_000, 5))
+    y = X @ np.arange(1, 6)
+    model = machine_learning_utils.train_rf(y, X)
+    X_pred = rng.normal(size=(size, 5))
+    return lambda: machine_learning_utils.predict_rf(*model, X_pred)
+
+
+def bench_get_latlon_index(size, tmp):
+    import netCDF4
+    import netcdf_utils
+    path = synthetic_data.make_netcdf(tmp.joinpath('grid.nc'), n_time=2,
+                                      n_lat=size, n_lon=2*size)
+    nc = netCDF4.Dataset(path)
+    return lambda: netcdf_utils.get_latlon_index(nc, 46.8, -71.2)
+
+
+def bench_plot_footprint_over_map(size, tmp):
+    import matplotlib.pyplot as plt
+    import plot_utils
+    background = synthetic_data.make_geotiff(tmp.joinpath('map.tif'),
+                                             width=size, height=size)
+    footprint = synthetic_data.make_footprint_pickle(tmp.joinpath('footprint.pkl'))
+    coordinates = (250000 + size * 0.05, 5200000 - size * 0.05)
+    def run():
+        plot_utils._read_background_map.cache_clear()
+        fig, ax = plot_utils.plot_footprint_over_map(
+            footprint, background, coordinates, show=False)
+        fig.canvas.draw()
+        plt.close(fig)
+    return run
+
+
+def bench_make_tarfile(size, tmp):
+    import archive_and_compress
+    root = synthetic_data.make_station_folders(
+        tmp.joinpath('raw'), n_collections=1, n_stations=1, n_files=size)
+    station = root.joinpath('collection_0', 'station_0')
+    return lambda: archive_and_compress.make_tarfile(station, tmp.joinpath('station.tar.gz'))
+
+
+def bench_read_diagnostics(size, tmp):
+    import get_instrument_diagnostic
+    directory = tmp.joinpath('eddy')
+    synthetic_data.make_toa5_eddy_files(directory, size, n_rows=2000)
+    date_end = (np.datetime64('2023-01-01T00:00') + np.timedelta64(30 * (size - 1), 'm'))
+    date_end = str(date_end).replace('-', '').replace('T', ' ').replace(':', '')
+    return lambda: get_instrument_diagnostic.read_diagnostics(
+        directory, 'diag_77', '20230101 0000', date_end, '%Y%m%d_%H%M_eddy.csv')
+
+
+# name: (function, small sizes, large sizes)
+benchmarks = {
+    'density_scatter_plot': (bench_density_scatter_plot, [10_000], [1_000_000]),
+    'density_kde': (bench_density_kde, [2_000], [10_000]),
+    'binned_statistics': (bench_binned_statistics, [100_000], [5_000_000]),
+    'get_raster_hist': (bench_get_raster_hist, [500], [4000]),
+    'get_shapefile_extent': (bench_get_shapefile_extent, [100], [10_000]),
+    'train_rf': (bench_train_rf, [2_000], [50_000]),
+    'predict_rf': (bench_predict_rf, [10_000], [500_000]),
+    'get_latlon_index': (bench_get_latlon_index, [180], [1800]),
+    'plot_footprint_over_map': (bench_plot_footprint_over_map, [1000], [8000]),
+    'make_tarfile': (bench_make_tarfile, [5], [100]),
+    'read_diagnostics': (bench_read_diagnostics, [5], [96]),
+    }
+
+
+def measure(func, repeat=3):
+    """
+    Measure the best wall time over repeat runs and the peak memory
+    allocated during one run. A first warm-up run loads the lazily imported
+    dependencies and fills the caches of the imported modules.
+
+    Returns
+    -------
+    result : Dictionary {'time': seconds, 'peak_memory': bytes}
+    """
+    func()
+    tracemalloc.start()
+    func()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return {'time': min(times), 'peak_memory': peak_memory}
+
+
+def run(names, quick=False, repeat=3):
+    """ Run the benchmarks and return {'name[size]': result}."""
+    results = {}
+    for name in names:
+        func, small, large = benchmarks[name]
+        for size in (small if quick else small + large):
+            with tempfile.TemporaryDirectory() as tmp:
+                result = measure(func(size, Path(tmp)), repeat)
+            key = f'{name}[{size}]'
+            results[key] = result
+            print(f'{key:<40} {result["time"]:>10.4f} s '
+                  f'{result["peak_memory"] / 2**20:>10.1f} MiB', flush=True)
+    return results
+
+
+def compare(results, baseline, threshold=1.2):
+    """ Print the ratio of results to the baseline and return the keys that
+    are slower (or use more memory) than threshold times the baseline."""
+    regressions = []
+    print(f'\n{"benchmark":<40} {"time ratio":>10} {"memory ratio":>12}')
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        time_ratio = result['time'] / baseline[key]['time']
+        memory_ratio = result['peak_memory'] / max(1, baseline[key]['peak_memory'])
+        flag = ''
+        if time_ratio > threshold or memory_ratio > threshold:
+            regressions.append(key)
+            flag = '  <-- regression'
+        print(f'{key:<40} {time_ratio:>10.2f} {memory_ratio:>12.2f}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-k', '--filter', default='',
+                        help='Only run benchmarks whose name contains this string')
+    parser.add_argument('-q', '--quick', action='store_true',
+                        help='Only run the small data sizes')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', type=Path, default=default_baseline)
+    parser.add_argument('--save', action='store_true',
+                        help='Save the results as the baseline')
+    parser.add_argument('--compare', action='store_true',
+                        help='Compare the results to the baseline')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='Ratio to the baseline reported as a regression')
+    args = parser.parse_args()
+
+    names = [name for name in benchmarks if args.filter in name]
+    results = run(names, args.quick, args.repeat)
+
+    if args.save:
+        baseline = {}
+        if args.baseline.is_file():
+            baseline = json.loads(args.baseline.read_text())
+        baseline.update(results)
+        args.baseline.write_text(json.dumps(baseline, indent=2))
+        print(f'Baseline saved in {args.baseline}')
+
+    if args.compare:
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 19:37:16 2026
+
+Generators of synthetic datasets used by the benchmarks. Everything is
+created locally, no network access is needed.
+"""
+
+import pickle
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+
+def make_toa5_eddy_files(directory, n_files, n_rows=18000,
+                         diag_variable='diag_77',
+                         file_format='%Y%m%d_%H%M_eddy.csv',
+                         date_start='20230101 0000', seed=42):
+    """
+    Write half-hourly eddy covariance files in the Campbell Scientific TOA5
+    format (4 header lines, column names on the second line).
+
+    Parameters
+    ----------
+    directory : String or Pathlib Path
+    n_files : Int
+        Number of half-hourly files
+    n_rows : Int, optional
+        Rows per file. The default is 18000 (10 Hz).
+    diag_variable : String, optional
+        Name of the diagnostic column. The default is 'diag_77'.
+    file_format : String, optional
+        Date format of the file names. The default is '%Y%m%d_%H%M_eddy.csv'.
+    date_start : String, optional
+        Date of the first file. The default is '20230101 0000'.
+    seed : Int, optional
+
+    Returns
+    -------
+    files : List of Pathlib Path
+    """
+    rng = np.random.default_rng(seed)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    codes = np.array([0, 0, 0, 1, 2, 64, 256, 4096])
+
+    files = []
+    for date in pd.date_range(pd.to_datetime(date_start), periods=n_files, freq='30min'):
+        timestamps = date + pd.to_timedelta(np.arange(n_rows) * 100, unit='ms')
+        df = pd.DataFrame({
+            'TIMESTAMP': timestamps.strftime('%Y-%m-%d %H:%M:%S.%f').str[:-5],
+            'RECORD': np.arange(n_rows),
+            'Ux': rng.normal(size=n_rows),
+            'Uy': rng.normal(size=n_rows),
+            'Uz': rng.normal(size=n_rows) * 0.3,
+            diag_variable: rng.choice(codes, size=n_rows),
+            })
+        file = directory.joinpath(date.strftime(file_format))
+        with open(file, 'w') as f:
+            f.write('"TOA5","station","CR3000","1","CR3000.Std","CPU:eddy.CR3","1","ts_data"\n')
+            f.write(','.join(f'"{c}"' for c in df.columns) + '\n')
+            f.write(','.join('""' for c in df.columns) + '\n')
+            f.write(','.join('"Smp"' for c in df.columns) + '\n')
+            df.to_csv(f, header=False, index=False)
+        files.append(file)
+    return files
+
+
+def make_geotiff(path, width=2000, height=2000, count=3, dtype='uint8',
+                 resolution=0.1, origin=(250000, 5200000), seed=42):
+    """
+    Write a projected GeoTIFF (EPSG:32198) with random data.
+
+    Returns
+    -------
+    path : Pathlib Path
+    """
+    import rasterio
+    from rasterio.transform import from_origin
+
+    rng = np.random.default_rng(seed)
+    data = (rng.random((count, height, width)) * 255).astype(dtype)
+    with rasterio.open(path, 'w', driver='GTiff', width=width, height=height,
+                       count=count, dtype=dtype, crs='EPSG:32198', tiled=True,
+                       transform=from_origin(*origin, resolution, resolution)) as dst:
+        dst.write(data)
+    return Path(path)
+
+
+def make_shapefile(path, n_polygons=100, seed=42):
+    """
+    Write a shapefile of random squares (EPSG:32198).
+
+    Returns
+    -------
+    path : Pathlib Path
+    """
+    import geopandas as gpd
+    from shapely.geometry import box
+
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(250000, 260000, n_polygons)
+    y = rng.uniform(5200000, 5210000, n_polygons)
+    geometry = [box(xi, yi, xi + 100, yi + 100) for xi, yi in zip(x, y)]
+    gpd.GeoDataFrame({'id': np.arange(n_polygons)}, geometry=geometry,
+                     crs='EPSG:32198').to_file(path)
+    return Path(path)
+
+
+def make_netcdf(path, n_time=24, n_lat=180, n_lon=360, seed=42):
+    """
+    Write a NetCDF file with a (time, latitude, longitude) variable 't2m'.
+
+    Returns
+    -------
+    path : Pathlib Path
+    """
+    import netCDF4
+
+    rng = np.random.default_rng(seed)
+    with netCDF4.Dataset(path, 'w') as nc:
+        nc.createDimension('time', n_time)
+        nc.createDimension('latitude', n_lat)
+        nc.createDimension('longitude', n_lon)
+        nc.createVariable('time', 'f8', ('time',))[:] = np.arange(n_time)
+        nc.createVariable('latitude', 'f4', ('latitude',))[:] = \
+            np.linspace(90, -90, n_lat)
+        nc.createVariable('longitude', 'f4', ('longitude',))[:] = \
+            np.linspace(-180, 180, n_lon, endpoint=False)
+        t2m = nc.createVariable('t2m', 'f4', ('time', 'latitude', 'longitude'))
+        t2m[:] = rng.normal(280, 10, (n_time, n_lat, n_lon))
+    return Path(path)
+
+
+def make_footprint(n=201, extent=200., seed=None):
+    """
+    Footprint dictionary with the fields of the Kljun algorithm (x_2d,
+    y_2d, fclim_2d, rs, fr), with a skewed plume upwind of the station.
+
+    Returns
+    -------
+    footprint : Dictionary
+    """
+    rng = np.random.default_rng(seed)
+    direction = rng.uniform(0, 2*np.pi) if seed is not None else 0.
+    x = np.linspace(-extent, extent, n)
+    x_2d, y_2d = np.meshgrid(x, x)
+    u = x_2d * np.cos(direction) + y_2d * np.sin(direction)
+    v = -x_2d * np.sin(direction) + y_2d * np.cos(direction)
+    fclim_2d = np.where(u > 0, u * np.exp(-u / 20 - v**2 / (2 * (5 + u/5)**2)), 0)
+    fclim_2d /= fclim_2d.sum() * (x[1] - x[0])**2
+
+    rs = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8]
+    f_sorted = np.sort(fclim_2d, axis=None)[::-1]
+    f_cumsum = np.cumsum(f_sorted) * (x[1] - x[0])**2
+    fr = [float(f_sorted[np.searchsorted(f_cumsum, r)]) for r in rs]
+    return {'x_2d': x_2d, 'y_2d': y_2d, 'fclim_2d': fclim_2d, 'rs': rs, 'fr': fr}
+
+
+def make_footprint_pickle(path, n=201, seed=None):
+    """ Write a pickled footprint dictionary (see make_footprint)."""
+    with open(path, 'wb') as f:
+        pickle.dump(make_footprint(n, seed=seed), f)
+    return Path(path)
+
+
+def make_station_folders(root, n_collections=2, n_stations=3,
+                         n_files=10, file_size=100_000, seed=42):
+    """
+    Create field collection folders containing station folders of raw
+    files, as processed by archive_and_compress.
+
+    Returns
+    -------
+    root : Pathlib Path
+    """
+    rng = np.random.default_rng(seed)
+    root = Path(root)
+    for i_collection in range(n_collections):
+        for i_station in range(n_stations):
+            station = root.joinpath(f'collection_{i_collection}', f'station_{i_station}')
+            station.mkdir(parents=True, exist_ok=True)
+            for i_file in range(n_files):
+                # Text data compresses like real logger files
+                values = rng.normal(size=file_size // 10).round(3)
+                station.joinpath(f'file_{i_file}.dat').write_text(
+                    '\n'.join(map(str, values)))
+    return root
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 19:44:08 2026
+
+Discovery of the data files of the stations. Each directory is listed once
+with os.scandir instead of testing the existence of every candidate path,
+which is slow on network shares, and the dates are parsed from all the file
+names at once. Several directories are listed concurrently in threads
+(listing a directory mostly waits on the file system).
+"""
+
+import fnmatch
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+
+try:
+    from ._lazy import lazy_import
+except ImportError:
+    from _lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+
+def list_directory(directory, pattern='*', files=True, subdirectories=True,
+                   with_size=False):
+    """
+    List the entries of a directory in a single os.scandir call.
+
+    Parameters
+    ----------
+    directory : String or Pathlib Path
+    pattern : String, optional
+        Shell-style pattern of the names (see fnmatch). The default is '*'.
+    files : Bool, optional
+        Include the files. The default is True.
+    subdirectories : Bool, optional
+        Include the subdirectories. The default is True.
+    with_size : Bool, optional
+        Get the size of the files. It costs a stat call per file, so it is
+        only done when needed. The default is False.
+
+    Returns
+    -------
+    entries : Dictionary
+        {name: size in bytes} sorted by name. The size is None if with_size
+        is False, and 0 for subdirectories. Empty if the directory does not
+        exist or is a file.
+    """
+    entries = {}
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if pattern != '*' and not fnmatch.fnmatch(entry.name, pattern):
+                    continue
+                # is_dir and is_file use the type returned by the listing
+                if entry.is_dir():
+                    if subdirectories:
+                        entries[entry.name] = 0
+                elif files and entry.is_file():
+                    entries[entry.name] = entry.stat().st_size if with_size else None
+    except (FileNotFoundError, NotADirectoryError):
+        return {}
+    return dict(sorted(entries.items()))
+
+
+def scan_directories(directories, n_jobs=8, **kwargs):
+    """
+    List several directories concurrently.
+
+    Parameters
+    ----------
+    directories : List of String or Pathlib Path
+    n_jobs : Int, optional
+        Number of threads. The default is 8.
+    **kwargs :
+        Arguments of list_directory
+
+    Returns
+    -------
+    listings : Dictionary
+        {directory: entries} (see list_directory), in the order of
+        directories
+    """
+    directories = [Path(d) for d in directories]
+    if len(directories) <= 1 or n_jobs == 1:
+        return {d: list_directory(d, **kwargs) for d in directories}
+    with ThreadPoolExecutor(max_workers=min(n_jobs, len(directories))) as executor:
+        listings = executor.map(lambda d: list_directory(d, **kwargs), directories)
+        return dict(zip(directories, listings))
+
+
+def parse_file_dates(names, file_format):
+    """
+    Parse the dates of file names in a vectorized way.
+
+    Parameters
+    ----------
+    names : List of String
+        File names
+    file_format : String
+        Date format of the file names, for example '%Y%m%d_%H%M_eddy.csv'
+
+    Returns
+    -------
+    dates : Pandas DatetimeIndex
+        Date of each name, NaT for the names that do not match file_format
+    """
+    return pd.to_datetime(pd.Index(names, dtype=object), format=file_format,
+                          errors='coerce')
+
+
+def find_dated_files(directories, file_format, date_start=None, date_end=None,
+                     n_jobs=8):
+    """
+    Find the files whose name matches a date format, between two dates.
+
+    Parameters
+    ----------
+    directories : String, Pathlib Path or list of them
+        Directories of the files. They are listed concurrently.
+    file_format : String
+        Date format of the file names, for example '%Y%m%d_%H%M_eddy.csv'
+    date_start, date_end : String or datetime, optional
+        First and last dates (included), for example '20220615 0000'. The
+        default is None (no limit).
+    n_jobs : Int, optional
+        Number of threads listing the directories. The default is 8.
+
+    Returns
+    -------
+    files : Pandas Series
+        Paths of the files indexed by their date, sorted by date
+    """
+    if isinstance(directories, (str, os.PathLike)):
+        directories = [directories]
+    listings = scan_directories(directories, n_jobs, subdirectories=False)
+
+    paths = [directory.joinpath(name)
+             for directory, entries in listings.items() for name in entries]
+    dates = parse_file_dates([path.name for path in paths], file_format)
+
+    keep = np.asarray(dates.notna())
+    if date_start is not None:
+        keep &= np.asarray(dates >= pd.to_datetime(date_start))
+    if date_end is not None:
+        keep &= np.asarray(dates <= pd.to_datetime(date_end))
+
+    files = pd.Series(np.array(paths, dtype=object)[keep], index=dates[keep],
+                      dtype=object)
+    return files.sort_index(kind='stable')
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 19:32:03 2026
+
+Tools to store footprints computed by the Kljun method and to build
+footprint climatologies. The footprints are dictionaries with the fields
+x_2d, y_2d, fclim_2d, rs and fr, as consumed by
+plot_utils.plot_footprint_over_map. They can be stored either as pickled
+dictionaries or as compact NPZ files (see save_footprint).
+"""
+
+import itertools
+import pickle
+import struct
+import zipfile
+from collections.abc import Mapping
+from pathlib import Path
+import numpy as np
+
+try:
+    from ._lazy import lazy_import
+    from .instrumentation import instrument
+except ImportError:
+    from _lazy import lazy_import
+    from instrumentation import instrument
+
+interpolate = lazy_import('scipy.interpolate')
+
+
+def _npz_memmap(path, name):
+    """ Memory-map an array stored without compression in a NPZ file.
+    Return None if the array is compressed."""
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo(f'{name}.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+
+    with open(path, 'rb') as f:
+        # Skip the zip local file header, then read the npy header
+        f.seek(info.header_offset)
+        name_length, extra_length = struct.unpack('<HH', f.read(30)[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape, offset=offset,
+                     order='F' if fortran_order else 'C')
+
+
+class Footprint(Mapping):
+    """
+    Read-only footprint dictionary backed by a NPZ file written by
+    save_footprint. Arrays are only read when accessed: fclim_2d is
+    memory-mapped when the file is not compressed, and the x_2d and y_2d
+    meshes are rebuilt from the 1-D axes on first access.
+
+    Parameters
+    ----------
+    path : String or Pathlib Path
+        Path to the NPZ file
+    """
+
+    _keys = ('x_2d', 'y_2d', 'fclim_2d', 'rs', 'fr')
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._npz = np.load(self.path)
+        self._cache = {}
+
+    def __getitem__(self, key):
+        if key not in self._cache:
+            match key:
+                case 'x' | 'y' | 'rs' | 'fr':
+                    self._cache[key] = self._npz[key]
+                case 'fclim_2d':
+                    fs = _npz_memmap(self.path, key)
+                    self._cache[key] = self._npz[key] if fs is None else fs
+                case 'x_2d' | 'y_2d':
+                    self._cache['x_2d'], self._cache['y_2d'] = np.meshgrid(
+                        self['x'], self['y'])
+                case _:
+                    raise KeyError(key)
+        return self._cache[key]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+def save_footprint(path, footprint, compress=False):
+    """
+    Save a footprint in a NPZ file with 1-D axes and a float32 grid.
+
+    Parameters
+    ----------
+    path : String or Pathlib Path
+        Path of the NPZ file
+    footprint : Dictionary
+        Footprint dictionary with the fields x_2d, y_2d, fclim_2d, rs and fr
+    compress : Bool, optional
+        Compress the file. Compressed files are smaller but fclim_2d can not
+        be memory-mapped when read. The default is False.
+    """
+    x, y = grid_axes(footprint['x_2d'], footprint['y_2d'])
+    fs = footprint['fclim_2d']
+    if np.ma.isMaskedArray(fs):
+        fs = fs.filled(np.nan)
+    savez = np.savez_compressed if compress else np.savez
+    savez(path, x=x, y=y, fclim_2d=np.asarray(fs, dtype=np.float32),
+          rs=np.asarray(footprint.get('rs', []), dtype=float),
+          fr=np.asarray(footprint.get('fr', []), dtype=float))
+
+
+def load_footprint(footprint):
+    """
+    Load a footprint dictionary
+
+    Parameters
+    ----------
+    footprint : Dictionary, String or Pathlib Path
+        Footprint dictionary, path to a NPZ footprint file (see
+        save_footprint) or path to a pickled footprint dictionary
+
+    Returns
+    -------
+    footprint_dict : Dictionary or Footprint
+    """
+    if isinstance(footprint, Mapping):
+        return footprint
+    if Path(footprint).suffix == '.npz':
+        return Footprint(footprint)
+    with open(footprint, 'rb') as f:
+        return pickle.load(f)
+
+
+def convert_pickle_to_npz(pickle_files, output_dir=None, compress=False):
+    """
+    Convert pickled footprint dictionaries to NPZ footprint files.
+
+    Parameters
+    ----------
+    pickle_files : List of String or Pathlib Path
+        Pickled footprint dictionaries
+    output_dir : String or Pathlib Path, optional
+        Directory of the NPZ files. If not specified, the NPZ files are
+        written next to the pickles.
+    compress : Bool, optional
+        Compress the files (see save_footprint). The default is False.
+
+    Returns
+    -------
+    npz_files : List of Pathlib Path
+    """
+    npz_files = []
+    for pickle_file in pickle_files:
+        pickle_file = Path(pickle_file)
+        directory = pickle_file.parent if output_dir is None else Path(output_dir)
+        npz_file = directory.joinpath(pickle_file.stem).with_suffix('.npz')
+        save_footprint(npz_file, load_footprint(pickle_file), compress)
+        npz_files.append(npz_file)
+    return npz_files
+
+
+def grid_axes(x_2d, y_2d):
+    """
+    Get the 1-D axes of a footprint grid created with np.meshgrid(x, y).
+
+    Parameters
+    ----------
+    x_2d : Numpy array (ny, nx)
+    y_2d : Numpy array (ny, nx)
+
+    Returns
+    -------
+    x : Numpy array (nx,)
+    y : Numpy array (ny,)
+    """
+    return np.asarray(x_2d)[0,:], np.asarray(y_2d)[:,0]
+
+
+def footprint_contour_levels(fclim_2d, dx, dy, rs):
+    """
+    Footprint values at which the footprint contains the fractions rs of the
+    total flux. The values are sorted in decreasing order once and the
+    levels are found on their cumulative sum.
+
+    Parameters
+    ----------
+    fclim_2d : Numpy array (ny, nx)
+        Normalised footprint function values [m-2]
+    dx : Float
+        Grid spacing in x [m]
+    dy : Float
+        Grid spacing in y [m]
+    rs : List of float
+        Fractions of the footprint (between 0 and 1)
+
+    Returns
+    -------
+    fr : List of float
+        Footprint value at each fraction rs. NaN if the grid does not
+        contain the fraction.
+    """
+    f_sorted = np.sort(fclim_2d, axis=None)[::-1]
+    f_cumsum = np.cumsum(f_sorted, dtype=np.float64) * dx * dy
+    idx = np.searchsorted(f_cumsum, rs)
+    return [float(f_sorted[i]) if i < f_sorted.size else np.nan for i in idx]
+
+
+class FootprintAccumulator():
+    """
+    Accumulate footprints onto a common grid to build a footprint
+    climatology. The sum is kept in a float32 array updated in place, so
+    any number of footprints can be streamed without keeping them in memory.
+
+    Parameters
+    ----------
+    x : Numpy array (nx,)
+        x axis of the common grid, relative to the station [m]
+    y : Numpy array (ny,)
+        y axis of the common grid, relative to the station [m]
+    """
+
+    def __init__(self, x, y):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.fsum = np.zeros((self.y.size, self.x.size), dtype=np.float32)
+        self.weight = 0.
+        self.count = 0
+        self._points = None
+
+    @classmethod
+    def from_footprint(cls, footprint):
+        """ Create an accumulator on the grid of a footprint."""
+        footprint = load_footprint(footprint)
+        return cls(*grid_axes(footprint['x_2d'], footprint['y_2d']))
+
+    def _on_grid(self, x, y):
+        return (x.size == self.x.size and y.size == self.y.size
+                and np.allclose(x, self.x) and np.allclose(y, self.y))
+
+    def add(self, footprint, weight=1.):
+        """
+        Add a footprint to the climatology.
+
+        Parameters
+        ----------
+        footprint : Dictionary, String or Pathlib Path
+            Footprint dictionary (x_2d, y_2d and fclim_2d) or path to it.
+            Footprints on another grid are linearly interpolated onto the
+            common grid (zero outside of their grid).
+        weight : Float, optional
+            Weight of the footprint, for example the flux or the duration
+            it represents. The default is 1.
+        """
+        footprint = load_footprint(footprint)
+        fs = footprint['fclim_2d']
+        if np.ma.isMaskedArray(fs):
+            fs = fs.filled(0)
+        x, y = grid_axes(footprint['x_2d'], footprint['y_2d'])
+
+        if not self._on_grid(x, y):
+            if self._points is None:
+                yy, xx = np.meshgrid(self.y, self.x, indexing='ij')
+                self._points = np.column_stack((yy.ravel(), xx.ravel()))
+            interpolator = interpolate.RegularGridInterpolator(
+                (y, x), fs, bounds_error=False, fill_value=0)
+            fs = interpolator(self._points).reshape(self.fsum.shape)
+
+        if not np.isfinite(fs).all():
+            fs = np.nan_to_num(fs)
+        if weight == 1:
+            self.fsum += fs
+        else:
+            self.fsum += np.float32(weight) * fs.astype(np.float32)
+        self.weight += weight
+        self.count += 1
+
+    def climatology(self, rs=np.arange(0.1, 0.9, 0.1)):
+        """
+        Footprint climatology in the format of the Kljun algorithm.
+
+        Parameters
+        ----------
+        rs : List of float, optional
+            Fractions of the footprint for which the contour levels fr are
+            computed. Fractions that the grid does not contain (grid
+            smaller than the footprint) are left out of rs and fr. The
+            default is 0.1, 0.2, ..., 0.8.
+
+        Returns
+        -------
+        footprint_dict : Dictionary
+            Dictionary with the fields x_2d, y_2d, fclim_2d, rs, fr and n
+            (number of footprints)
+        """
+        x_2d, y_2d = np.meshgrid(self.x, self.y)
+        fclim_2d = self.fsum / np.float32(self.weight) if self.weight else self.fsum.copy()
+        dx = np.abs(np.mean(np.diff(self.x)))
+        dy = np.abs(np.mean(np.diff(self.y)))
+        rs = [float(r) for r in rs]
+        fr = footprint_contour_levels(fclim_2d, dx, dy, rs)
+        # NaN contour levels can not be drawn
+        rs, fr = [r for r, f in zip(rs, fr) if np.isfinite(f)], \
+            [f for f in fr if np.isfinite(f)]
+        return {'x_2d': x_2d, 'y_2d': y_2d, 'fclim_2d': fclim_2d,
+                'rs': rs, 'fr': fr, 'n': self.count}
+
+    def save(self, path, rs=np.arange(0.1, 0.9, 0.1)):
+        """ Save the climatology in a file readable by
+        plot_utils.plot_footprint_over_map: a NPZ footprint file if the
+        path ends with .npz, a pickled dictionary otherwise."""
+        if Path(path).suffix == '.npz':
+            save_footprint(path, self.climatology(rs))
+            return
+        with open(path, 'wb') as f:
+            pickle.dump(self.climatology(rs), f)
+
+
+@instrument()
+def aggregate_footprints(footprints, labels, x=None, y=None, weights=None,
+                         rs=np.arange(0.1, 0.9, 0.1)):
+    """
+    Build one footprint climatology per label (month, season, etc.) from a
+    stream of footprints.
+
+    Parameters
+    ----------
+    footprints : Iterable of dictionaries, Strings or Pathlib Paths
+        Footprints (for example half-hourly footprints)
+    labels : Iterable
+        Label of each footprint, for example
+        pd.DatetimeIndex(timestamps).to_period('M')
+    x, y : Numpy arrays, optional
+        Axes of the common grid. If not specified, the grid of the first
+        footprint is used.
+    weights : Iterable of float, optional
+        Weight of each footprint. The default is 1 for all footprints.
+    rs : List of float, optional
+        Fractions of the footprint for the contour levels. The default is
+        0.1, 0.2, ..., 0.8.
+
+    Returns
+    -------
+    climatologies : Dictionary
+        {label: footprint dictionary} (see FootprintAccumulator.climatology)
+    """
+    if weights is None:
+        weights = itertools.repeat(1.)
+
+    accumulators = {}
+    for footprint, label, weight in zip(footprints, labels, weights):
+        footprint = load_footprint(footprint)
+        if label not in accumulators:
+            if x is None:
+                x, y = grid_axes(footprint['x_2d'], footprint['y_2d'])
+            accumulators[label] = FootprintAccumulator(x, y)
+        accumulators[label].add(footprint, weight)
+
+    return {label: acc.climatology(rs) for label, acc in accumulators.items()}
@@ -9,12 +9,35 @@ diagnostic as well as its frequency of occurence between the dates date_start
 and date_end.
 The date format in the file name should be specified.
 Works for LICOR LI7700 and Campbell Scientific Irgason.
+In watch mode, the new files of the directory are decoded as they arrive and
+an alert is written when the rate of a critical flag crosses a threshold.
+
+Usage:
+    python get_instrument_diagnostic.py Path_to_directory --diag-variable diag_77
+        --date-start "20220615 0000" --date-end "20231025 0000"
+    python get_instrument_diagnostic.py Path_to_directory --diag-variable diag_77
+        --watch --alert-file alerts.jsonl --threshold 0.05
 """
 
+import argparse
+import json
 import pathlib
-import pandas as pd
+import time
+from collections import deque
+from datetime import datetime
 import numpy as np
-from tqdm import tqdm
+
+try:
+    from ._lazy import lazy_import
+    from .file_discovery import list_directory, find_dated_files, parse_file_dates
+    from .instrumentation import instrument, record
+except ImportError:
+    from _lazy import lazy_import
+    from file_discovery import list_directory, find_dated_files, parse_file_dates
+    from instrumentation import instrument, record
+
+pd = lazy_import('pandas')
+tqdm = lazy_import('tqdm')
 
 dir_path = pathlib.Path("Path_to_directory")
 diag_variable = 'diag_77'
@@ -22,6 +45,17 @@ date_start = '20220615 0000'
 date_end   = '20231025 0000'
 file_format = '%Y%m%d_%H%M_eddy.csv'
 
+# Flags reporting a fault, used by the watch mode. The other flags report
+# the normal state of the instrument (analyzer attached, heaters, washer
+# pump, start up, summary flag) and do not raise alerts by default.
+default_critical_flags = {
+    'diag_77': [32768, 16384, 8192, 4096, 2048, 1024, 16, 8, 4, 2],
+    'diag_irga': [4194304, 2097152, 1048576, 524288, 262144, 131072, 65536,
+                  32768, 16384, 8192, 4096, 2048, 1024, 512, 256, 128, 64,
+                  32, 16, 8, 2],
+    'diag_sonic': [32, 8, 4, 2, 1],
+    }
+
 
 def build_diag_header_table(diag_variable):
     if diag_variable == 'diag_77':
@@ -105,48 +139,330 @@ def print_diag_header_table(diag_code, timestamp, diag_header_table):
     print('\n')
 
 
-### Variable initialization ###
-date_range = pd.date_range(
-    pd.to_datetime(date_start),
-    pd.to_datetime(date_end),
-    freq='30min').strftime(file_format)
-diagnostics = []
-timestamps = []
-all_value_counts = {}
-
-### Read files ###
-print('Reading files...')
-for file in tqdm(date_range):
-
-    if dir_path.joinpath(file).exists():
-        df = pd.read_csv(dir_path.joinpath(file),skiprows=[0,2,3])
-    else:
-        print(f"File {dir_path.joinpath(file)} doesn't exist")
-        continue
-    if diag_variable in df.columns:
-        unique_indices = df.drop_duplicates(subset=diag_variable).index
-    else:
-        print(f'{diag_variable} not present in file {dir_path.joinpath(file)}')
-        continue
-
-    # Perform value counts on diag_variable column
-    counts = df[diag_variable].value_counts()
-    # Accumulate the value counts in the dictionary
-    for index, count in counts.items():
-        all_value_counts[index] = all_value_counts.get(index, 0) + count
-
-    # Get timing of the diagnostic code
-    for i in df.loc[unique_indices,['TIMESTAMP', diag_variable]].index:
-        if df.loc[i,diag_variable] not in diagnostics:
-            diagnostics.append(int(df.loc[i,diag_variable]))
-            timestamps.append(df.loc[i,'TIMESTAMP'])
-
-# Convert the dictionary to a DataFrame for easy manipulation and analysis
-diag_counts = pd.DataFrame(list(all_value_counts.items()), columns=[diag_variable, 'count'])
-diag_counts = diag_counts.sort_values(by='count', ascending=False)
-
-### Print error codes encountered, number of occurences and their timing ###
-print(diag_counts,'\n')
-diag_header_table = build_diag_header_table(diag_variable)
-for i_diag, i_timestamp in zip(diagnostics,timestamps):
-    print_diag_header_table(i_diag, i_timestamp, diag_header_table)
\ No newline at end of file
+def decode_flags(diag_codes, diag_header_table):
+    """
+    Count the occurence of each flag of the diagnostic codes. The bits of
+    the distinct codes are tested at once against the values of the header
+    table.
+
+    Parameters
+    ----------
+    diag_codes : Numpy array or Pandas Series
+        Diagnostic codes. Missing, negative or non numeric codes are
+        counted as invalid.
+    diag_header_table : Pandas DataFrame
+        Table created by build_diag_header_table
+
+    Returns
+    -------
+    flag_counts : Numpy array
+        Number of codes with each flag of diag_header_table raised, in the
+        order of the table
+    n_valid : Int
+        Number of valid codes
+    """
+    diag_codes = pd.to_numeric(pd.Series(np.ravel(diag_codes)), errors='coerce').to_numpy()
+    diag_codes = diag_codes[np.isfinite(diag_codes) & (diag_codes >= 0)].astype(np.int64)
+    # Loggers repeat a few codes, decode each distinct code once
+    codes, counts = np.unique(diag_codes, return_counts=True)
+    flag_values = diag_header_table['val'].to_numpy(dtype=np.int64)
+    flag_counts = counts @ ((codes[:,np.newaxis] & flag_values) != 0)
+    return flag_counts, diag_codes.size
+
+
+class DiagnosticMonitor():
+    """
+    Rolling statistics of the diagnostic flags over the last files. An alert
+    is raised when the rate of a critical flag (fraction of the records of
+    the window with the flag raised) crosses the threshold, and cleared when
+    it falls back below it.
+
+    Parameters
+    ----------
+    diag_variable : String
+        'diag_77', 'diag_irga' or 'diag_sonic'
+    window : Int, optional
+        Number of files of the rolling window. The default is 48 (one day of
+        half-hourly files).
+    threshold : Float, optional
+        Flag rate raising an alert, between 0 and 1. The default is 0.1.
+    critical_flags : List of Int, optional
+        Values of the critical flags (e.g. [16384, 8192]). The default is
+        None (the fault flags of default_critical_flags).
+    """
+
+    def __init__(self, diag_variable, window=48, threshold=0.1, critical_flags=None):
+        self.diag_variable = diag_variable
+        self.diag_header_table = build_diag_header_table(diag_variable)
+        self.threshold = threshold
+        flag_values = self.diag_header_table['val'].to_numpy()
+        if critical_flags is None:
+            critical_flags = default_critical_flags[diag_variable]
+        self.critical = np.isin(flag_values, critical_flags)
+        self.history = deque(maxlen=window)
+        self.flag_counts = np.zeros(flag_values.size, dtype=np.int64)
+        self.n_valid = 0
+        self.alerting = np.zeros(flag_values.size, dtype=bool)
+
+    @property
+    def rates(self):
+        """ Rate of each flag over the window."""
+        return self.flag_counts / max(self.n_valid, 1)
+
+    def update(self, diag_codes, label=None):
+        """
+        Add the diagnostic codes of a file to the window.
+
+        Parameters
+        ----------
+        diag_codes : Numpy array or Pandas Series
+            Diagnostic codes of the file
+        label : String, optional
+            Name of the file, reported in the alerts
+
+        Returns
+        -------
+        alerts : List of dictionaries
+            Alerts raised or cleared by the file
+        """
+        flag_counts, n_valid = decode_flags(diag_codes, self.diag_header_table)
+        if len(self.history) == self.history.maxlen:
+            old_counts, old_valid = self.history[0]
+            self.flag_counts -= old_counts
+            self.n_valid -= old_valid
+        self.history.append((flag_counts, n_valid))
+        self.flag_counts += flag_counts
+        self.n_valid += n_valid
+
+        rates = self.rates
+        above = self.critical & (rates >= self.threshold)
+        alerts = []
+        for i in np.flatnonzero(above != self.alerting):
+            alerts.append({
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'file': label,
+                'variable': self.diag_variable,
+                'state': 'raised' if above[i] else 'cleared',
+                'flag': int(self.diag_header_table['val'].iloc[i]),
+                'code': self.diag_header_table['code'].iloc[i],
+                'rate': round(float(rates[i]), 4),
+                'threshold': self.threshold,
+                'n_files': len(self.history),
+                })
+        self.alerting = above
+        return alerts
+
+
+def watch_directory(dir_path, diag_variable, file_format, alert_file=None,
+                    poll_interval=2., quiet_period=60., window=48, threshold=0.1,
+                    critical_flags=None, process_existing=False, n_polls=None):
+    """
+    Watch a directory and decode the diagnostics of the new files as they
+    are written by the logger. A file is considered complete, and processed,
+    once a file with a later date exists or once it has not been modified
+    for quiet_period seconds. Files that can not be opened (locked by the
+    logger, moved) are retried at the next poll. Alerts are printed and
+    appended to alert_file as JSON lines.
+
+    Parameters
+    ----------
+    dir_path : Pathlib Path
+        Directory of the files
+    diag_variable : String
+        'diag_77', 'diag_irga' or 'diag_sonic'
+    file_format : String
+        Date format of the file names, for example '%Y%m%d_%H%M_eddy.csv'
+    alert_file : String or Pathlib Path, optional
+        File where alerts are appended. The default is None (print only).
+    poll_interval : Float, optional
+        Seconds between two scans of the directory. The default is 2.
+    quiet_period : Float, optional
+        Seconds without modification after which the latest file is
+        considered complete. The default is 60.
+    window, threshold, critical_flags : optional
+        See DiagnosticMonitor
+    process_existing : Bool, optional
+        Also process the files present when the watch starts. The default
+        is False.
+    n_polls : Int, optional
+        Number of scans before returning. The default is None (watch until
+        interrupted).
+
+    Returns
+    -------
+    monitor : DiagnosticMonitor
+    """
+    monitor = DiagnosticMonitor(diag_variable, window, threshold, critical_flags)
+    processed = set()
+
+    def scan():
+        """ Names of the dated files, sorted by date."""
+        names = list(list_directory(dir_path, subdirectories=False))
+        dates = parse_file_dates(names, file_format)
+        return [name for date, name in sorted(
+            (date, name) for name, date in zip(names, dates) if not pd.isna(date))]
+
+    if not process_existing:
+        processed.update(scan())
+
+    i_poll = 0
+    try:
+        while n_polls is None or i_poll < n_polls:
+            i_poll += 1
+            names = scan()
+            for i_name, name in enumerate(names):
+                if name in processed:
+                    continue
+                try:
+                    # The logger has finished writing the file when a later
+                    # file exists or when the file stopped changing
+                    is_latest = i_name == len(names) - 1
+                    if is_latest and (time.time() - dir_path.joinpath(name).stat().st_mtime
+                                      < quiet_period):
+                        continue
+                    df = pd.read_csv(dir_path.joinpath(name), skiprows=[0,2,3],
+                                     usecols=[diag_variable])
+                except OSError as e:
+                    print(f'Could not open {name}, retrying at the next poll: {e}')
+                    continue
+                except (ValueError, pd.errors.ParserError) as e:
+                    print(f'Could not read {diag_variable} in {name}: {e}')
+                    processed.add(name)
+                    continue
+                processed.add(name)
+
+                for alert in monitor.update(df[diag_variable], name):
+                    print(f"{alert['time']} {alert['state']}: {alert['code']} "
+                          f"({alert['flag']}) in {alert['rate']:.1%} of the records")
+                    if alert_file is not None:
+                        with open(alert_file, 'a') as f:
+                            f.write(json.dumps(alert) + '\n')
+
+            if n_polls is None or i_poll < n_polls:
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        pass
+    return monitor
+
+
+@instrument()
+def read_diagnostics(dir_path, diag_variable, date_start, date_end, file_format):
+    """
+    Read the diagnostic variable in the files of dir_path between date_start
+    and date_end.
+
+    Parameters
+    ----------
+    dir_path : Pathlib Path
+        Directory of the files
+    diag_variable : String
+        'diag_77', 'diag_irga' or 'diag_sonic'
+    date_start, date_end : String
+        First and last dates of the files, for example '20220615 0000'
+    file_format : String
+        Date format of the file names, for example '%Y%m%d_%H%M_eddy.csv'
+
+    Returns
+    -------
+    diag_counts : Pandas DataFrame
+        Number of occurence of each diagnostic code, sorted by count
+    diagnostics : List of Int
+        Diagnostic codes encountered
+    timestamps : List of String
+        Timestamp of the first occurence of each diagnostic code
+    """
+    ### Variable initialization ###
+    dir_path = pathlib.Path(dir_path)
+    date_range = pd.date_range(
+        pd.to_datetime(date_start),
+        pd.to_datetime(date_end),
+        freq='30min')
+    files = find_dated_files(dir_path, file_format, date_start, date_end)
+    diagnostics = []
+    timestamps = []
+    all_value_counts = {}
+
+    for date in date_range.difference(files.index):
+        print(f"File {dir_path.joinpath(date.strftime(file_format))} doesn't exist")
+
+    ### Read files ###
+    print('Reading files...')
+    for file in tqdm.tqdm(files):
+
+        df = pd.read_csv(file,skiprows=[0,2,3])
+        record(rows=len(df), files=1)
+        if diag_variable in df.columns:
+            unique_indices = df.drop_duplicates(subset=diag_variable).index
+        else:
+            print(f'{diag_variable} not present in file {file}')
+            continue
+
+        # Perform value counts on diag_variable column
+        counts = df[diag_variable].value_counts()
+        # Accumulate the value counts in the dictionary
+        for index, count in counts.items():
+            all_value_counts[index] = all_value_counts.get(index, 0) + count
+
+        # Get timing of the diagnostic code
+        for i in df.loc[unique_indices,['TIMESTAMP', diag_variable]].index:
+            if df.loc[i,diag_variable] not in diagnostics:
+                diagnostics.append(int(df.loc[i,diag_variable]))
+                timestamps.append(df.loc[i,'TIMESTAMP'])
+
+    # Convert the dictionary to a DataFrame for easy manipulation and analysis
+    diag_counts = pd.DataFrame(list(all_value_counts.items()), columns=[diag_variable, 'count'])
+    diag_counts = diag_counts.sort_values(by='count', ascending=False)
+    return diag_counts, diagnostics, timestamps
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Print the instrument diagnostics found in the files of a directory.')
+    parser.add_argument('dir_path', nargs='?', type=pathlib.Path, default=dir_path,
+                        help='Directory of the files')
+    parser.add_argument('--diag-variable', default=diag_variable,
+                        choices=['diag_77', 'diag_irga', 'diag_sonic'])
+    parser.add_argument('--date-start', default=date_start,
+                        help='First date, for example "20220615 0000"')
+    parser.add_argument('--date-end', default=date_end,
+                        help='Last date, for example "20231025 0000"')
+    parser.add_argument('--file-format', default=file_format,
+                        help='Date format of the file names')
+    parser.add_argument('--watch', action='store_true',
+                        help='Watch the directory and decode the new files as they arrive')
+    parser.add_argument('--alert-file', type=pathlib.Path,
+                        help='Watch mode: file where alerts are appended as JSON lines')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Watch mode: flag rate raising an alert')
+    parser.add_argument('--window', type=int, default=48,
+                        help='Watch mode: number of files of the rolling window')
+    parser.add_argument('--critical-flags', type=int, nargs='+',
+                        help='Watch mode: values of the critical flags (default fault flags)')
+    parser.add_argument('--quiet-period', type=float, default=60.,
+                        help='Watch mode: seconds without modification after which '
+                        'the latest file is considered complete')
+    parser.add_argument('--poll-interval', type=float, default=2.,
+                        help='Watch mode: seconds between two scans of the directory')
+    args = parser.parse_args()
+
+    if args.watch:
+        watch_directory(args.dir_path, args.diag_variable, args.file_format,
+                        args.alert_file, poll_interval=args.poll_interval,
+                        quiet_period=args.quiet_period, window=args.window,
+                        threshold=args.threshold,
+                        critical_flags=args.critical_flags)
+        return
+
+    diag_counts, diagnostics, timestamps = read_diagnostics(
+        args.dir_path, args.diag_variable, args.date_start, args.date_end,
+        args.file_format)
+
+    ### Print error codes encountered, number of occurences and their timing ###
+    print(diag_counts,'\n')
+    diag_header_table = build_diag_header_table(args.diag_variable)
+    for i_diag, i_timestamp in zip(diagnostics,timestamps):
+        print_diag_header_table(i_diag, i_timestamp, diag_header_table)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,11 +5,20 @@ Created on Tue Apr  2 11:26:13 2024
 @author: ANTHI182
 """
 
-import rasterio
-import pyproj
 import numpy as np
-import geopandas as gpd
 
+try:
+    from ._lazy import lazy_import
+    from .instrumentation import instrument, record
+except ImportError:
+    from _lazy import lazy_import
+    from instrumentation import instrument, record
+
+rasterio = lazy_import('rasterio')
+pyproj = lazy_import('pyproj')
+gpd = lazy_import('geopandas')
+
+@instrument()
 def get_raster_hist(raster_file, bins=10, band=1):
     """
     Create a histogram for a raster
@@ -33,6 +42,7 @@ def get_raster_hist(raster_file, bins=10, band=1):
 
     src = rasterio.open(raster_file)
     data = src.read(band)
+    record(rows=data.size)
     bin_counts, bin_egdes = np.histogram(data, bins=bins)
     return bin_counts, bin_egdes
 
@@ -130,6 +140,7 @@ def degrees_to_projected_meter(coord, projection):
     return x_meter, y_meter
 
 
+@instrument()
 def get_shapefile_extent(shapefile):
     """
     Get the bounding box of a shapefile
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 19:41:56 2026
+
+Opt-in instrumentation of the main functions of the utilities. When it is
+enabled, each instrumented call records its wall time, the bytes read and
+written by the process, the rows processed, the peak memory allocated
+(tracemalloc) and the maximum resident memory of the process. Records are
+sent as JSON to the 'utils.instrumentation' logger and optionally appended
+to a metrics file (one JSON record per line). A profiling mode saves a
+cProfile file per outermost instrumented call (open with pstats or
+snakeviz). Instrumented functions keep their names, so py-spy stacks stay
+readable.
+
+Instrumentation is disabled by default and costs a single test per call.
+It can be enabled with enable_instrumentation() or with the environment
+variables:
+    UTILS_INSTRUMENT=1                 enable
+    UTILS_METRICS_FILE=metrics.jsonl   append records to this file
+    UTILS_PROFILE_DIR=profiles         save cProfile files in this directory
+"""
+
+import contextvars
+import cProfile
+import functools
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger('utils.instrumentation')
+
+_config = {
+    'enabled': os.environ.get('UTILS_INSTRUMENT', '').lower() in ('1', 'true', 'yes'),
+    'metrics_file': os.environ.get('UTILS_METRICS_FILE'),
+    'profile_dir': os.environ.get('UTILS_PROFILE_DIR'),
+    'trace_memory': True,
+    }
+_file_lock = threading.Lock()
+_profile_counter = itertools.count()
+_active = contextvars.ContextVar('active_instruments', default=())
+
+
+def enable_instrumentation(metrics_file=None, profile_dir=None, trace_memory=True):
+    """
+    Enable the instrumentation.
+
+    Parameters
+    ----------
+    metrics_file : String or Pathlib Path, optional
+        File where records are appended as JSON lines. The default is None
+        (records are only logged).
+    profile_dir : String or Pathlib Path, optional
+        Directory where a cProfile file is saved for each outermost
+        instrumented call. The default is None (no profiling).
+    trace_memory : Bool, optional
+        Record the peak memory allocated with tracemalloc. It slows down
+        code that allocates many small Python objects. The default is True.
+    """
+    _config.update(enabled=True, metrics_file=metrics_file,
+                   profile_dir=profile_dir, trace_memory=trace_memory)
+
+
+def disable_instrumentation():
+    """ Disable the instrumentation."""
+    _config['enabled'] = False
+
+
+def _io_counters():
+    """ Bytes read and written by the process (Linux only)."""
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _max_rss():
+    """ Maximum resident memory of the process in bytes."""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _write_record(record):
+    logger.info(json.dumps(record))
+    if _config['metrics_file']:
+        with _file_lock, open(_config['metrics_file'], 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+
+def record(**counters):
+    """
+    Add counters (for example rows=len(df)) to the innermost instrumented
+    call in progress. Does nothing when no instrumented call is active.
+    """
+    active = _active.get()
+    if not active:
+        return
+    for key, value in counters.items():
+        active[-1].counters[key] = active[-1].counters.get(key, 0) + value
+
+
+class instrument():
+    """
+    Decorator and context manager recording the metrics of a call when the
+    instrumentation is enabled. After the call, the measures are available
+    as the attributes wall_time and peak_memory of the context manager.
+
+    The peak memory is only traced in the main thread: tracemalloc is global
+    to the process, so instruments in other threads would reset the peak of
+    each other. It is None for the instruments entered in other threads.
+
+    Parameters
+    ----------
+    name : String, optional
+        Name of the record. The default is the qualified name of the
+        decorated function.
+    measure : Bool, optional
+        Measure the call even if the instrumentation is disabled (the record
+        is only written when it is enabled). The default is False.
+    trace_memory : Bool, optional
+        Trace the peak memory. The default is None (see
+        enable_instrumentation).
+
+    Examples
+    --------
+    @instrument()
+    def train_rf(target_var, input_vars):
+        ...
+
+    with instrument('read files'):
+        ...
+    """
+
+    def __init__(self, name=None, measure=False, trace_memory=None):
+        self.name = name
+        self.measure = measure
+        self.trace_memory = trace_memory
+        self.counters = {}
+        self.wall_time = None
+        self.peak_memory = None
+
+    def __call__(self, func):
+        name = self.name or f'{func.__module__}.{func.__qualname__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _config['enabled']:
+                return func(*args, **kwargs)
+            with instrument(name, self.measure, self.trace_memory):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        self._log = _config['enabled']
+        self._enabled = self._log or self.measure
+        if not self._enabled:
+            return self
+
+        parents = _active.get()
+        self._token = _active.set(parents + (self,))
+        self._outermost = not parents
+        self._child_peak = 0
+
+        self._tracing = _config['trace_memory'] if self.trace_memory is None \
+            else self.trace_memory
+        self._tracing &= threading.current_thread() is threading.main_thread()
+        self._started_tracing = False
+        if self._tracing:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            elif parents:
+                # Keep the peak of the parent before measuring ours
+                parents[-1]._child_peak = max(parents[-1]._child_peak,
+                                              tracemalloc.get_traced_memory()[1])
+            self._memory_start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+
+        self._profile = None
+        if self._outermost and self._log and _config['profile_dir']:
+            self._profile = cProfile.Profile()
+            try:
+                self._profile.enable()
+            except ValueError:
+                # Another profiler is active (e.g. in another thread)
+                self._profile = None
+
+        self._start = datetime.now()
+        self._io_start = _io_counters()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self._enabled:
+            return False
+        self.wall_time = time.perf_counter() - self._t0
+
+        if self._profile is not None:
+            self._profile.disable()
+            profile_dir = Path(_config['profile_dir'])
+            profile_dir.mkdir(parents=True, exist_ok=True)
+            self._profile.dump_stats(profile_dir.joinpath(
+                f'{self.name}_{self._start:%Y%m%d_%H%M%S}_{os.getpid()}'
+                f'_{next(_profile_counter)}.prof'))
+
+        if self._tracing:
+            peak = max(tracemalloc.get_traced_memory()[1], self._child_peak)
+            self.peak_memory = peak - self._memory_start
+            if self._started_tracing:
+                tracemalloc.stop()
+            else:
+                parents = _active.get()[:-1]
+                if parents:
+                    parents[-1]._child_peak = max(parents[-1]._child_peak, peak)
+
+        io_end = _io_counters()
+        bytes_read = bytes_written = None
+        if io_end[0] is not None and self._io_start[0] is not None:
+            bytes_read = io_end[0] - self._io_start[0]
+            bytes_written = io_end[1] - self._io_start[1]
+
+        _active.reset(self._token)
+        if not self._log:
+            return False
+        _write_record({
+            'name': self.name,
+            'start': self._start.isoformat(),
+            'wall_time': self.wall_time,
+            'bytes_read': bytes_read,
+            'bytes_written': bytes_written,
+            'peak_memory': self.peak_memory,
+            'max_rss': _max_rss(),
+            'pid': os.getpid(),
+            'error': None if exc_type is None else exc_type.__name__,
+            **self.counters,
+            })
+        return False
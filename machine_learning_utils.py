@@ -4,11 +4,29 @@ Created on Tue Aug 29 16:04:27 2023
 
 @author: ANTHI182
 """
+import hashlib
+import os
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.preprocessing import StandardScaler
-from sklearn import linear_model
-from sklearn import metrics
+
+try:
+    from ._lazy import lazy_import, force_load
+    from .instrumentation import instrument, record
+except ImportError:
+    from _lazy import lazy_import, force_load
+    from instrumentation import instrument, record
+
+pd = lazy_import('pandas')
+joblib = lazy_import('joblib')
+ensemble = lazy_import('sklearn.ensemble')
+preprocessing = lazy_import('sklearn.preprocessing')
+linear_model = lazy_import('sklearn.linear_model')
+metrics = lazy_import('sklearn.metrics')
+model_selection = lazy_import('sklearn.model_selection')
 
 def compute_score(target_var, predicted_var,score='r2_score'):
     """
@@ -28,11 +46,138 @@ def compute_score(target_var, predicted_var,score='r2_score'):
     """
     score_func = getattr(metrics, score)
     mask = np.isfinite(target_var) & np.isfinite(predicted_var)
-    if sum(mask) == 0: return None
+    if not mask.any(): return None
     return score_func(target_var[mask],predicted_var[mask])
 
 
-def train_lm(target_var, input_vars):
+def _group_scores(y, e, p, group_id, n_groups, scores, weights=None):
+    """ Compute scores for each group from the target (y), the error (e)
+    and the prediction (p) with weighted sums (np.bincount)."""
+
+    def gsum(v=None):
+        if v is None:
+            v = weights
+        elif weights is not None:
+            v = v * weights
+        return np.bincount(group_id, weights=v, minlength=n_groups)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n = gsum() if weights is not None else \
+            np.bincount(group_id, minlength=n_groups).astype(float)
+        sum_e2 = gsum(e**2)
+        # Deviations to the (weighted) group means, to avoid the cancellation
+        # of sum(y^2) - sum(y)^2/n for large offsets
+        dy = y - (gsum(y) / n)[group_id]
+        dp = p - (gsum(p) / n)[group_id]
+        ss_y = gsum(dy**2)
+        ss_p = gsum(dp**2)
+        sp_yp = gsum(dy*dp)
+
+        out = {'n': n}
+        for score in scores:
+            match score:
+                case 'r2':
+                    out[score] = 1 - sum_e2 / ss_y
+                case 'r':
+                    out[score] = sp_yp / np.sqrt(ss_y * ss_p)
+                case 'rmse':
+                    out[score] = np.sqrt(sum_e2 / n)
+                case 'mse':
+                    out[score] = sum_e2 / n
+                case 'mae':
+                    out[score] = gsum(np.abs(e)) / n
+                case 'bias':
+                    out[score] = gsum(e) / n
+                case _:
+                    raise ValueError(f'Unknown score {score}')
+    return out
+
+
+def _bootstrap_scores(y, e, p, group_id, n_groups, scores, n_boot, seed):
+    """ Poisson bootstrap: each resample is a set of Poisson(1) weights,
+    which keeps the computation vectorized over groups."""
+    rng = np.random.default_rng(seed)
+    boot = {score: np.empty((n_boot, n_groups)) for score in scores}
+    for i in range(n_boot):
+        w = rng.poisson(1, size=y.shape[0]).astype(float)
+        out = _group_scores(y, e, p, group_id, n_groups, scores, weights=w)
+        for score in scores:
+            boot[score][i] = out[score]
+    return boot
+
+
+@instrument()
+def compute_scores(target_var, predicted_var, scores=('r2','rmse','mae','bias'),
+                   groups=None, n_boot=0, ci=95, n_jobs=None, seed=42):
+    """
+    Compute several scores in one pass with target_var as reference,
+    optionally for each group of a label array and with bootstrap
+    confidence intervals.
+
+    Parameters
+    ----------
+    target_var : numpy array (n,)
+        target variable
+    predicted_var : numpy array (n,)
+        predicted variable
+    scores : tuple of strings, optional
+        Scores to compute among 'r2', 'r', 'rmse', 'mse', 'mae' and 'bias'
+        (mean of predicted - target). The default is ('r2','rmse','mae','bias').
+    groups : numpy array (n,), optional
+        Labels (station, month, hour of day, etc.) used to group the data.
+        If not specified, the scores are computed over all data.
+    n_boot : int, optional
+        Number of bootstrap resamples used to compute confidence intervals.
+        The default is 0 (no confidence interval).
+    ci : float, optional
+        Confidence interval in percent. The default is 95.
+    n_jobs : int, optional
+        Number of parallel jobs for the bootstrap (see joblib.Parallel).
+        The default is None.
+    seed : int, optional
+        Seed of the bootstrap random generator. The default is 42.
+
+    Returns
+    -------
+    df : pandas DataFrame
+        One row per group with the number of valid samples (n), the scores
+        and, if n_boot > 0, the bounds of the confidence intervals
+        (<score>_low, <score>_high)
+    """
+
+    target_var = np.asarray(target_var, dtype=float)
+    predicted_var = np.asarray(predicted_var, dtype=float)
+    if groups is None:
+        groups = np.zeros(target_var.shape[0], dtype=int)
+    groups = np.asarray(groups)
+
+    # Shared mask and group indices, computed once for all the scores
+    mask = np.isfinite(target_var) & np.isfinite(predicted_var)
+    labels, group_id = np.unique(groups[mask], return_inverse=True)
+    y, p = target_var[mask], predicted_var[mask]
+    e = p - y
+
+    df = pd.DataFrame(_group_scores(y, e, p, group_id, len(labels), scores),
+                      index=pd.Index(labels, name='group'))
+
+    if n_boot > 0:
+        n_chunks = max(1, min(n_boot, joblib.effective_n_jobs(n_jobs)))
+        chunks = np.array_split(np.arange(n_boot), n_chunks)
+        seeds = np.random.SeedSequence(seed).spawn(n_chunks)
+        boots = joblib.Parallel(n_jobs=n_jobs)(
+            joblib.delayed(_bootstrap_scores)(y, e, p, group_id, len(labels),
+                                              scores, len(chunk), s)
+            for chunk, s in zip(chunks, seeds))
+        for score in scores:
+            boot = np.concatenate([b[score] for b in boots])
+            df[f'{score}_low'] = np.nanpercentile(boot, (100-ci)/2, axis=0)
+            df[f'{score}_high'] = np.nanpercentile(boot, 100-(100-ci)/2, axis=0)
+
+    return df
+
+
+@instrument()
+def train_lm(target_var, input_vars, **kwargs):
     """ Train a linear model
 
     Parameters
@@ -41,6 +186,8 @@ def train_lm(target_var, input_vars):
         target variable
     input_vars : numpy array (n,m)
         input variables
+    **kwargs :
+        Parameters passed to sklearn.linear_model.LinearRegression
 
     Returns
     -------
@@ -58,11 +205,12 @@ def train_lm(target_var, input_vars):
         X = input_vars[mask,:]
     y = target_var[mask,np.newaxis]
 
-    regr = linear_model.LinearRegression()
+    regr = linear_model.LinearRegression(**kwargs)
     regr.fit(X, y.flatten())
 
     return regr
 
+@instrument()
 def predict_lm(regr, input_vars):
     """ Predict values with a trained linear model
 
@@ -92,7 +240,8 @@ def predict_lm(regr, input_vars):
     return y_pred
 
 
-def train_rf(target_var, input_vars):
+@instrument()
+def train_rf(target_var, input_vars, n_estimators=25, random_state=42, **kwargs):
     """ Train a random forest regressor
 
     Parameters
@@ -101,6 +250,12 @@ def train_rf(target_var, input_vars):
         target variable
     input_vars : numpy array (n,m)
         input variables
+    n_estimators : int, optional
+        Number of trees in the forest. The default is 25.
+    random_state : int, optional
+        Seed of the random forest. The default is 42.
+    **kwargs :
+        Other parameters passed to sklearn.ensemble.RandomForestRegressor
 
     Returns
     -------
@@ -117,19 +272,22 @@ def train_rf(target_var, input_vars):
 
     X_unscaled = input_vars[mask,:]
     y_unscaled = target_var[mask,np.newaxis]
+    record(rows=X_unscaled.shape[0])
 
-    scalerX = StandardScaler().fit(X_unscaled)
-    scalery = StandardScaler().fit(y_unscaled)
+    scalerX = preprocessing.StandardScaler().fit(X_unscaled)
+    scalery = preprocessing.StandardScaler().fit(y_unscaled)
 
     X = scalerX.transform(X_unscaled)
     y = scalery.transform(y_unscaled)
 
-    regr = RandomForestRegressor(n_estimators=25,random_state=42)
+    regr = ensemble.RandomForestRegressor(n_estimators=n_estimators,
+                                 random_state=random_state, **kwargs)
     regr.fit(X, y.flatten())
 
     return scalerX, scalery, regr
 
 
+@instrument()
 def predict_rf(scalerX, scalery, regr, input_vars):
     """ Predict values with a trained random forest model
 
@@ -155,6 +313,7 @@ def predict_rf(scalerX, scalery, regr, input_vars):
     y_pred = np.zeros((mask.shape[0])) * np.nan
 
     X = scalerX.transform(input_vars[mask,:])
+    record(rows=X.shape[0])
 
     y_pred_unindex = scalery.inverse_transform(
         np.expand_dims( regr.predict(X), axis=1))
@@ -162,3 +321,737 @@ def predict_rf(scalerX, scalery, regr, input_vars):
     y_pred[mask] = y_pred_unindex.flatten()
 
     return y_pred
+
+
+def predict_rf_spread(scalerX, scalery, regr, input_vars):
+    """ Predict values with a trained random forest model along with the
+    spread of the predictions across the trees of the forest.
+
+    Parameters
+    ----------
+    scalerX : Scikit scaler object
+        Scaler of inputs
+    scalery : Scikit scaler object
+        Scaler of output
+    regr : Scikit model object
+        Scikit random forest fitted to target
+    input_vars : numpy array (n,m)
+        Input variables
+
+    Returns
+    -------
+    y_pred : numpy array (n,)
+        Predicted variable (mean of the trees)
+    y_std : numpy array (n,)
+        Standard deviation of the predictions of the individual trees
+    """
+
+    mask = np.isfinite(input_vars).all(axis=1)
+    y_pred = np.full(mask.shape[0], np.nan)
+    y_std = np.full(mask.shape[0], np.nan)
+    if not mask.any(): return y_pred, y_std
+
+    X = scalerX.transform(input_vars[mask,:])
+
+    # Predictions of each tree, in the scaled target space
+    y_trees = np.stack([tree.predict(X) for tree in regr.estimators_])
+
+    y_pred[mask] = scalery.inverse_transform(
+        y_trees.mean(axis=0)[:,np.newaxis]).flatten()
+    y_std[mask] = y_trees.std(axis=0) * scalery.scale_[0]
+
+    return y_pred, y_std
+
+
+def _gap_fill_window(target_var, input_vars, train_slice, fill_slice,
+                     min_samples, rf_kwargs):
+    """ Train a random forest on train_slice and predict the gaps of
+    fill_slice. Return None if there is not enough valid training data."""
+
+    target = target_var[train_slice]
+    inputs = input_vars[train_slice,:]
+    n_valid = np.count_nonzero(
+        np.isfinite(target) & np.isfinite(inputs).all(axis=1))
+    if n_valid < min_samples: return fill_slice, None, None
+
+    scalerX, scalery, regr = train_rf(target, inputs, **rf_kwargs)
+    # Only predict the gaps, fill_slice can span several blocks
+    gaps = ~np.isfinite(target_var[fill_slice])
+    y_pred = np.full(gaps.shape, np.nan)
+    y_std = np.full(gaps.shape, np.nan)
+    y_pred[gaps], y_std[gaps] = predict_rf_spread(
+        scalerX, scalery, regr, input_vars[fill_slice,:][gaps,:])
+    return fill_slice, y_pred, y_std
+
+
+def _gap_fill_tasks(target_var, input_vars, window, block, stride, min_samples):
+    """ Generate the (train_slice, fill_slice) windows of a series that
+    contain at least one gap that can be filled and at least min_samples
+    valid training samples. Blocks with gaps that are less than stride
+    samples apart are filled by the same window."""
+
+    n = target_var.shape[0]
+    if n == 0: return
+    complete_inputs = np.isfinite(input_vars).all(axis=1)
+    # Gaps that can be filled: missing target but complete inputs
+    fillable = ~np.isfinite(target_var) & complete_inputs
+    # Cumulative number of valid training samples
+    n_valid = np.concatenate(
+        ([0], np.cumsum(np.isfinite(target_var) & complete_inputs)))
+
+    # Number of fillable gaps per block, computed once for the whole series
+    block_id = np.arange(n) // block
+    n_gaps = np.bincount(block_id, weights=fillable, minlength=block_id[-1]+1)
+
+    gap_blocks = np.flatnonzero(n_gaps)
+    i = 0
+    while i < len(gap_blocks):
+        # Group the following gap blocks that fit in stride samples
+        start = gap_blocks[i] * block
+        j = i + 1
+        while j < len(gap_blocks) and (gap_blocks[j] + 1) * block - start <= stride:
+            j += 1
+        stop = min(gap_blocks[j-1] * block + block, n)
+        i = j
+
+        train_start, train_stop = max(0, start - window), min(n, stop + window)
+        if n_valid[train_stop] - n_valid[train_start] < min_samples:
+            continue
+        yield slice(train_start, train_stop), slice(start, stop)
+
+
+def gap_fill_rf(target_var, input_vars, window=15*48, block=48,
+                stride=15*48, min_samples=100, n_jobs=None, **rf_kwargs):
+    """ Gap-fill a time series with random forests trained over moving
+    windows.
+
+    The series is split in blocks of `block` samples. Only the blocks that
+    contain gaps are processed. Consecutive blocks with gaps spanning at
+    most `stride` samples are grouped, and a single random forest is trained
+    on the group extended by `window` samples on each side and used to
+    predict all the gaps of the group, instead of one forest per block
+    trained on nearly the same samples. Windows are processed in parallel
+    with joblib, which memory-maps the input arrays so that overlapping
+    windows share the same data instead of copying it for every worker.
+
+    Parameters
+    ----------
+    target_var : numpy array (n,)
+        Target variable with gaps (NaN)
+    input_vars : numpy array (n,m)
+        Input variables (drivers)
+    window : int, optional
+        Number of samples added on each side of a block to build the
+        training window. The default is 15*48 (+/- 15 days of half-hourly
+        data).
+    block : int, optional
+        Number of samples of the blocks in which gaps are searched. The
+        default is 48 (one day of half-hourly data).
+    stride : int, optional
+        Maximum number of samples filled by one model. Use stride=block to
+        train one model per block with gaps. The default is 15*48.
+    min_samples : int, optional
+        Minimum number of valid samples in a training window. Gaps of
+        windows with fewer samples are left unfilled. The default is 100.
+    n_jobs : int, optional
+        Number of parallel jobs (see joblib.Parallel). The default is None.
+    **rf_kwargs :
+        Parameters passed to train_rf (n_estimators, max_depth, etc.)
+
+    Returns
+    -------
+    y_filled : numpy array (n,)
+        Gap-filled variable
+    y_std : numpy array (n,)
+        Spread of the random forest trees for the filled values, NaN
+        elsewhere
+    """
+
+    results = gap_fill_rf_stations(
+        {0: (target_var, input_vars)}, window=window, block=block,
+        stride=stride, min_samples=min_samples, n_jobs=n_jobs, **rf_kwargs)
+    return results[0]
+
+
+@instrument()
+def gap_fill_rf_stations(datasets, window=15*48, block=48, stride=15*48,
+                         min_samples=100, n_jobs=None, **rf_kwargs):
+    """ Gap-fill several time series (e.g. several stations or several
+    years) in a single call. All the windows of all the series are
+    processed in the same parallel pool. See gap_fill_rf for the details of
+    the method.
+
+    Parameters
+    ----------
+    datasets : dict
+        Dictionary {name: (target_var, input_vars)} with target_var a numpy
+        array (n,) and input_vars a numpy array (n,m)
+    window : int, optional
+        Number of samples added on each side of a block to build the
+        training window. The default is 15*48.
+    block : int, optional
+        Number of samples of the blocks in which gaps are searched. The
+        default is 48.
+    stride : int, optional
+        Maximum number of samples filled by one model. The default is 15*48.
+    min_samples : int, optional
+        Minimum number of valid samples in a training window. The default
+        is 100.
+    n_jobs : int, optional
+        Number of parallel jobs (see joblib.Parallel). The default is None.
+    **rf_kwargs :
+        Parameters passed to train_rf
+
+    Returns
+    -------
+    results : dict
+        Dictionary {name: (y_filled, y_std)}
+    """
+
+    datasets = {
+        name: (np.asarray(target, dtype=float),
+               np.asarray(inputs, dtype=float).reshape(len(target), -1)
+               if np.ndim(inputs) != 2 else np.asarray(inputs, dtype=float))
+        for name, (target, inputs) in datasets.items()}
+
+    tasks = [(name, train_slice, fill_slice)
+             for name, (target, inputs) in datasets.items()
+             for train_slice, fill_slice in _gap_fill_tasks(
+                     target, inputs, window, block, stride, min_samples)]
+
+    outputs = joblib.Parallel(n_jobs=n_jobs)(
+        joblib.delayed(_gap_fill_window)(
+            *datasets[name], train_slice, fill_slice, min_samples, rf_kwargs)
+        for name, train_slice, fill_slice in tasks)
+
+    results = {}
+    for name, (target, inputs) in datasets.items():
+        results[name] = (target.copy(), np.full(target.shape, np.nan))
+
+    for (name, _, _), (fill_slice, y_pred, y_std) in zip(tasks, outputs):
+        if y_pred is None: continue
+        y_filled, y_unc = results[name]
+        gaps = ~np.isfinite(y_filled[fill_slice]) & np.isfinite(y_pred)
+        y_filled[fill_slice][gaps] = y_pred[gaps]
+        y_unc[fill_slice][gaps] = y_std[gaps]
+
+    return results
+
+
+def data_fingerprint(*arrays):
+    """ Compute a fingerprint (hash) of the content of numpy arrays.
+
+    Parameters
+    ----------
+    *arrays : numpy arrays
+
+    Returns
+    -------
+    fingerprint : String
+        Hexadecimal SHA1 digest of the shapes, types and values of the arrays
+    """
+    h = hashlib.sha1()
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(f'{a.shape}{a.dtype}'.encode())
+        h.update(a.data)
+    return h.hexdigest()
+
+
+class ModelStore():
+    """
+    Store of trained models on disk, with a cache of predictions.
+
+    Each model is saved with joblib as a bundle containing the kind of model
+    ('lm' or 'rf'), the model itself (regr, or (scalerX, scalery, regr) for
+    random forests), the feature names, the training parameters and the
+    fingerprint of the training data. Models are loaded lazily, with
+    memory-mapped arrays, the first time they are used, and reloaded when
+    the file was replaced by another store or process. Files are replaced
+    atomically, so models already memory-mapped keep reading the old file.
+    Predictions are cached on disk keyed by the content of the model and
+    the hash of the input variables.
+
+    Parameters
+    ----------
+    directory : String or Pathlib Path
+        Directory where models and predictions are stored
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.joinpath('predictions').mkdir(parents=True, exist_ok=True)
+        self._bundles = {}
+        self._file_ids = {}
+
+    def _model_file(self, name):
+        return self.directory.joinpath(f'{name}.joblib')
+
+    def _file_id(self, name):
+        """ Identity of the model file, None if it does not exist."""
+        try:
+            stat = self._model_file(name).stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _replace(self, path, write):
+        """ Write a file with write(file object) then move it to path."""
+        tmp = path.with_name(f'.{path.name}.{os.getpid()}.{uuid.uuid4().hex}.tmp')
+        try:
+            with open(tmp, 'wb') as f:
+                write(f)
+            os.replace(tmp, path)
+        finally:
+            if tmp.exists(): tmp.unlink()
+
+    def save(self, name, kind, model, target_var=None, input_vars=None,
+             feature_names=None, params=None):
+        """ Save a trained model.
+
+        Parameters
+        ----------
+        name : String
+            Name of the model in the store
+        kind : String
+            'lm' for models from train_lm, 'rf' for models from train_rf
+        model : Scikit model object or tuple (scalerX, scalery, regr)
+            Output of train_lm or train_rf
+        target_var, input_vars : numpy arrays, optional
+            Training data, used to compute the fingerprint of the model
+        feature_names : list of strings, optional
+            Names of the input variables
+        params : Dictionary, optional
+            Keyword arguments given to train_lm or train_rf
+        """
+        fingerprint = None
+        if target_var is not None:
+            fingerprint = data_fingerprint(target_var, input_vars)
+        # Key of the cached predictions: the content of the model when it is
+        # known, a unique key otherwise
+        key = hashlib.sha1(repr(
+            (kind, sorted((params or {}).items()),
+             fingerprint or uuid.uuid4().hex)).encode()).hexdigest()
+        bundle = {'kind': kind, 'model': model, 'feature_names': feature_names,
+                  'params': params or {}, 'fingerprint': fingerprint, 'key': key}
+        self._replace(self._model_file(name), lambda f: joblib.dump(bundle, f))
+        self._bundles[name] = bundle
+        self._file_ids[name] = self._file_id(name)
+
+    def load(self, name):
+        """ Load a bundle (lazily, and again only if the file changed).
+        Return None if the model does not exist."""
+        file_id = self._file_id(name)
+        if file_id is None:
+            self._bundles.pop(name, None)
+            return None
+        if name not in self._bundles or self._file_ids.get(name) != file_id:
+            self._bundles[name] = joblib.load(self._model_file(name), mmap_mode='r')
+            self._file_ids[name] = file_id
+        return self._bundles[name]
+
+    def train(self, name, kind, target_var, input_vars, feature_names=None,
+              **kwargs):
+        """ Return a trained model, training it only if it is not in the
+        store or if its kind, its parameters or the training data changed.
+
+        Parameters
+        ----------
+        name : String
+            Name of the model in the store
+        kind : String
+            'lm' or 'rf'
+        target_var : numpy array (n,)
+            target variable
+        input_vars : numpy array (n,m)
+            input variables
+        feature_names : list of strings, optional
+            Names of the input variables
+        **kwargs :
+            Keyword arguments of train_lm or train_rf
+
+        Returns
+        -------
+        model : Scikit model object or tuple (scalerX, scalery, regr)
+        """
+        match kind:
+            case 'lm':
+                train = train_lm
+            case 'rf':
+                train = train_rf
+            case _:
+                raise ValueError(f"Unknown kind of model {kind}, expected 'lm' or 'rf'")
+
+        bundle = self.load(name)
+        fingerprint = data_fingerprint(target_var, input_vars)
+        if ((bundle is not None) and (bundle['kind'] == kind)
+                and (bundle.get('params', {}) == kwargs)
+                and (bundle['fingerprint'] == fingerprint)):
+            return bundle['model']
+
+        model = train(target_var, input_vars, **kwargs)
+        self.save(name, kind, model, target_var, input_vars, feature_names, kwargs)
+        return model
+
+    def predict(self, name, input_vars):
+        """ Predict with a stored model. Predictions already computed for
+        the same model and the same inputs are read from the cache.
+
+        Parameters
+        ----------
+        name : String
+            Name of the model in the store
+        input_vars : numpy array (n,m)
+            Input variables
+
+        Returns
+        -------
+        y_pred : numpy array (n,)
+            Predicted variable
+        """
+        bundle = self.load(name)
+        if bundle is None:
+            raise KeyError(f'No model named {name} in {self.directory}')
+        key = data_fingerprint(input_vars)
+        # Bundles saved before the content key existed use the file date
+        model_key = bundle.get('key') or self._file_ids[name][1]
+        cache_file = self.directory.joinpath(
+            'predictions', f'{name}_{model_key}_{key}.npy')
+        if cache_file.is_file():
+            return np.load(cache_file, mmap_mode='r')
+
+        match bundle['kind']:
+            case 'lm':
+                y_pred = predict_lm(bundle['model'], input_vars)
+            case 'rf':
+                y_pred = predict_rf(*bundle['model'], input_vars)
+        self._replace(cache_file, lambda f: np.save(f, y_pred))
+        return y_pred
+
+
+def blocked_folds(n, n_folds=5):
+    """ Split a time series in contiguous blocks used as test sets.
+
+    Parameters
+    ----------
+    n : int
+        Length of the time series
+    n_folds : int, optional
+        Number of folds. The default is 5.
+
+    Returns
+    -------
+    folds : list of numpy boolean arrays (n,)
+        Test mask of each fold
+    """
+    fold_id = np.arange(n) * n_folds // n
+    return [fold_id == i for i in range(n_folds)]
+
+
+def gap_lengths(target_var):
+    """ Length of the gaps (runs of consecutive non finite values) of a
+    time series.
+
+    Parameters
+    ----------
+    target_var : numpy array (n,)
+
+    Returns
+    -------
+    lengths : numpy array
+        Length of each gap
+    """
+    is_gap = np.concatenate(([0], ~np.isfinite(target_var), [0])).astype(int)
+    edges = np.flatnonzero(np.diff(is_gap))
+    return edges[1::2] - edges[0::2]
+
+
+def gap_folds(target_var, n_folds=5, gap_fraction=0.2, seed=42):
+    """ Create test sets made of artificial gaps mimicking the real gaps of
+    a time series (leave-gap-out cross-validation). Gap lengths are drawn
+    from the distribution of the gaps of target_var and placed randomly
+    until gap_fraction of the valid data is covered.
+
+    Parameters
+    ----------
+    target_var : numpy array (n,)
+        Target variable with real gaps
+    n_folds : int, optional
+        Number of folds. The default is 5.
+    gap_fraction : float, optional
+        Fraction of the valid data used as test set in each fold. The
+        default is 0.2.
+    seed : int, optional
+        Seed of the random generator. The default is 42.
+
+    Returns
+    -------
+    folds : list of numpy boolean arrays (n,)
+        Test mask of each fold (only valid data are selected)
+    """
+    rng = np.random.default_rng(seed)
+    valid = np.isfinite(target_var)
+    n = valid.shape[0]
+    lengths = gap_lengths(target_var)
+    if lengths.size == 0: lengths = np.array([1])
+    n_test = gap_fraction * np.count_nonzero(valid)
+
+    folds = []
+    for i in range(n_folds):
+        # Draw enough gaps at once to cover the requested fraction
+        n_draw = int(np.ceil(n_test / lengths.mean())) + 1
+        gap_len = rng.choice(lengths, size=n_draw)
+        gap_len = gap_len[:np.searchsorted(np.cumsum(gap_len), n_test) + 1]
+        gap_start = rng.integers(0, n, size=gap_len.size)
+
+        # Mark the gaps with a cumulative sum of starts and ends
+        marks = np.zeros(n + 1, dtype=int)
+        np.add.at(marks, gap_start, 1)
+        np.add.at(marks, np.minimum(gap_start + gap_len, n), -1)
+        folds.append((np.cumsum(marks[:-1]) > 0) & valid)
+    return folds
+
+
+def _evaluate_fold(model, params, target_var, input_vars, test_mask, scores,
+                   trace_memory):
+    """ Train a model without the test set, predict the test set and return
+    scores, timings and peak memory."""
+
+    train_target = np.where(test_mask, np.nan, target_var)
+    # Import sklearn before the measures, in each worker process
+    force_load(ensemble, preprocessing, linear_model, metrics)
+
+    # The instrument measures the fold even when the instrumentation is
+    # disabled, and shares tracemalloc with the instrumented functions
+    with instrument(f'{__name__}._evaluate_fold', measure=True,
+                    trace_memory=trace_memory) as fold:
+        t0 = time.perf_counter()
+        match model:
+            case 'lm':
+                regr = train_lm(train_target, input_vars, **params)
+                t1 = time.perf_counter()
+                y_pred = predict_lm(regr, input_vars[test_mask,:])
+            case 'rf':
+                scalerX, scalery, regr = train_rf(train_target, input_vars, **params)
+                t1 = time.perf_counter()
+                y_pred = predict_rf(scalerX, scalery, regr, input_vars[test_mask,:])
+        t2 = time.perf_counter()
+
+    peak_memory = np.nan if fold.peak_memory is None else fold.peak_memory
+
+    out = compute_scores(target_var[test_mask], y_pred, scores=scores)
+    out = out.iloc[0].to_dict() if len(out) else {}
+    out.update(fit_time=t1-t0, predict_time=t2-t1, peak_memory=peak_memory)
+    return out
+
+
+@instrument()
+def cross_validate(target_var, input_vars, model='rf', param_grid=None,
+                   folds=None, scores=('r2','rmse'), trace_memory=True,
+                   n_jobs=None):
+    """ Cross-validate train_lm or train_rf over a grid of parameters.
+    Folds and parameter combinations are evaluated in parallel.
+
+    Parameters
+    ----------
+    target_var : numpy array (n,)
+        target variable
+    input_vars : numpy array (n,m)
+        input variables
+    model : String, optional
+        'lm' (train_lm) or 'rf' (train_rf). The default is 'rf'.
+    param_grid : dict, optional
+        Dictionary {parameter: list of values} passed to the training
+        function (see sklearn.model_selection.ParameterGrid). The default
+        is None (default parameters).
+    folds : list of numpy boolean arrays (n,), optional
+        Test masks, as created by blocked_folds or gap_folds. The default
+        is gap_folds(target_var).
+    scores : tuple of strings, optional
+        Scores computed on the test sets (see compute_scores). The default
+        is ('r2','rmse').
+    trace_memory : Bool, optional
+        Record the peak memory of Python allocations during training and
+        prediction with tracemalloc. The default is True.
+    n_jobs : int, optional
+        Number of parallel jobs (see joblib.Parallel). The default is None.
+
+    Returns
+    -------
+    results : pandas DataFrame
+        One row per parameter combination with the parameters, the scores,
+        the fit and predict times (s) and peak memory (bytes) averaged over
+        the folds
+    """
+    if folds is None:
+        folds = gap_folds(target_var)
+    configs = list(model_selection.ParameterGrid(param_grid or {}))
+
+    outputs = joblib.Parallel(n_jobs=n_jobs)(
+        joblib.delayed(_evaluate_fold)(model, params, target_var, input_vars,
+                                       test_mask, scores, trace_memory)
+        for params in configs for test_mask in folds)
+
+    df = pd.DataFrame(outputs)
+    df['config'] = np.repeat(np.arange(len(configs)), len(folds))
+    results = df.groupby('config').mean()
+    params = pd.DataFrame(configs, index=results.index)
+    return pd.concat((params, results), axis=1)
+
+
+def select_cheapest(results, score='r2', threshold=0.8, cost='fit_time',
+                    greater_is_better=True):
+    """ Select the cheapest configuration of cross_validate results that
+    meets an accuracy target.
+
+    Parameters
+    ----------
+    results : pandas DataFrame
+        Output of cross_validate
+    score : String, optional
+        Score used for the accuracy target. The default is 'r2'.
+    threshold : float, optional
+        Accuracy target. The default is 0.8.
+    cost : String, optional
+        Column used as cost ('fit_time', 'predict_time' or 'peak_memory').
+        The default is 'fit_time'.
+    greater_is_better : Bool, optional
+        False for error scores (rmse, mae). The default is True.
+
+    Returns
+    -------
+    best : pandas Series or None
+        Cheapest configuration meeting the target, None if none does
+    """
+    if greater_is_better:
+        ok = results[results[score] >= threshold]
+    else:
+        ok = results[results[score] <= threshold]
+    if ok.empty: return None
+    return ok.loc[ok[cost].idxmin()]
+
+
+def _as_float_array(a):
+    """ Convert an array, memory-mapped array slice or NetCDF variable slice
+    (possibly masked) to a float numpy array with NaN for masked values."""
+    return np.ma.asarray(a).astype(float).filled(np.nan)
+
+
+def _iter_batches(input_vars, batch_size):
+    """ Yield (start, stop, X, shape) for each batch of input_vars, with X
+    a numpy array (k,m) and shape the shape of the predictions of the
+    batch."""
+
+    if isinstance(input_vars, (list, tuple)):
+        # One array per input variable, all with the same shape (n, ...)
+        n = input_vars[0].shape[0]
+        for start in range(0, n, batch_size):
+            stop = min(start + batch_size, n)
+            columns = [_as_float_array(v[start:stop]) for v in input_vars]
+            X = np.column_stack([c.ravel() for c in columns])
+            yield start, stop, X, columns[0].shape
+
+    elif hasattr(input_vars, 'shape') and hasattr(input_vars, '__getitem__'):
+        # Numpy array, memory-mapped array or NetCDF variable (n,m)
+        n = input_vars.shape[0]
+        for start in range(0, n, batch_size):
+            stop = min(start + batch_size, n)
+            X = _as_float_array(input_vars[start:stop])
+            yield start, stop, X.reshape(stop - start, -1), (stop - start,)
+
+    else:
+        # Iterable of chunks (k,m)
+        start = 0
+        for chunk in input_vars:
+            X = _as_float_array(chunk)
+            X = X.reshape(X.shape[0], -1)
+            yield start, start + X.shape[0], X, (X.shape[0],)
+            start += X.shape[0]
+
+
+def _predict_batch(model, X, shape):
+    """ Predict a batch with a model from train_lm (regr) or train_rf
+    (scalerX, scalery, regr)."""
+    if not np.isfinite(X).all(axis=1).any():
+        return np.full(shape, np.nan)
+    if isinstance(model, tuple):
+        y_pred = predict_rf(*model, X)
+    else:
+        y_pred = predict_lm(model, X)
+    return y_pred.reshape(shape)
+
+
+@instrument()
+def predict_in_batches(model, input_vars, batch_size=100_000, out=None,
+                       n_jobs=1):
+    """ Predict values in fixed-size batches so that the peak memory does
+    not depend on the size of the inputs. Results are written
+    incrementally to the output array.
+
+    Parameters
+    ----------
+    model : Scikit model object or tuple (scalerX, scalery, regr)
+        Output of train_lm or train_rf
+    input_vars : numpy array (n,m), memory-mapped array, NetCDF variable,
+        list of arrays or iterable of numpy arrays (k,m)
+        Input variables. A list (or tuple) is interpreted as one array per
+        input variable, all with the same shape (n, ...), for example NetCDF
+        variables (time, lat, lon). In that case predictions have the same
+        shape (n, ...). Other iterables (e.g. generators) yield successive
+        chunks of rows.
+    batch_size : int, optional
+        Number of rows (or of first-axis elements for a list of arrays) per
+        batch. The default is 100 000.
+    out : array-like, String or Pathlib Path, optional
+        Array where the predictions are written (numpy array, memory-mapped
+        array or NetCDF variable). If a path is given, a .npy memory-mapped
+        file is created. If not specified, a numpy array is created.
+    n_jobs : int, optional
+        Number of threads predicting batches concurrently, with the joblib
+        convention (None for 1 unless set by joblib.parallel_config, -1 for
+        all CPUs). At most n_jobs batches are held in memory at the same
+        time. The default is 1.
+
+    Returns
+    -------
+    out : array-like
+        Predicted variable
+    """
+
+    if isinstance(out, (str, Path)):
+        if isinstance(input_vars, (list, tuple)):
+            shape = input_vars[0].shape
+        else:
+            shape = (input_vars.shape[0],)
+        out = np.lib.format.open_memmap(out, mode='w+', dtype=float, shape=shape)
+    elif out is None and isinstance(input_vars, (list, tuple)):
+        out = np.empty(input_vars[0].shape)
+    elif out is None and hasattr(input_vars, 'shape'):
+        out = np.empty(input_vars.shape[0])
+
+    chunks = []
+    def write(start, stop, y_pred):
+        if out is None:
+            chunks.append(y_pred)
+        else:
+            out[start:stop] = y_pred
+
+    n_jobs = joblib.effective_n_jobs(n_jobs)
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        pending = deque()
+        for start, stop, X, shape in _iter_batches(input_vars, batch_size):
+            pending.append((start, stop,
+                            executor.submit(_predict_batch, model, X, shape)))
+            # Bound the number of batches in memory
+            if len(pending) >= n_jobs:
+                start, stop, future = pending.popleft()
+                write(start, stop, future.result())
+        while pending:
+            start, stop, future = pending.popleft()
+            write(start, stop, future.result())
+
+    if out is None:
+        out = np.concatenate(chunks) if chunks else np.empty(0)
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
@@ -4,12 +4,23 @@ Created on Mon Jan  8 15:42:31 2024
 
 @author: ANTHI182
 """
-import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
 import numpy as np
-import geopandas as gpd
 
+try:
+    from ._lazy import lazy_import
+    from .instrumentation import instrument
+    from .plot_utils import make_iterable_subplots
+except ImportError:
+    from _lazy import lazy_import
+    from instrumentation import instrument
+    from plot_utils import make_iterable_subplots
 
+plt = lazy_import('matplotlib.pyplot')
+gpd = lazy_import('geopandas')
+
+
+@instrument()
 def get_latlon_index(nc,lat,lon):
     if ('latitude' in nc.dimensions) & ('longitude' in nc.dimensions):
         id_lat = np.argmin(np.abs(nc.variables['latitude'][:] - lat))
@@ -58,12 +69,11 @@ def print_variable_dimension(nc, dim_names=False, sort_names=False):
 
 
 def show_mask(var, title='', id_slice=[0]):
-    nrows = len(id_slice) // np.sqrt(len(id_slice))
-    ncols = np.ceil(len(id_slice) / nrows)
-    fig, ax = plt.subplots(int(nrows),int(ncols))
-    ax = np.ravel(ax)
-    for i in range(0,len(ax)):
-        ax[i].imshow(var[i,:,:].mask.astype(float))
+    fig, ax = make_iterable_subplots(id_slice)
+    for i in range(0,len(id_slice)):
+        ax[i].imshow(np.ma.getmaskarray(var[id_slice[i],:,:]).astype(float))
+    for i in range(len(id_slice),len(ax)):
+        ax[i].set_visible(False)
     fig.suptitle(title)
 
 
@@ -71,14 +81,13 @@ def show_slice(var, title='', id_slice=[0]):
     if len(var.dimensions) < 3:
         print(f'Number of dimnesion different from 3 for {title}')
         return
-    nrows = len(id_slice) // np.sqrt(len(id_slice))
-    ncols = np.ceil(len(id_slice) / nrows)
-    fig, ax = plt.subplots(int(nrows),int(ncols))
-    ax = np.ravel(ax)
-    for i in range(0,len(ax)):
+    fig, ax = make_iterable_subplots(id_slice)
+    for i in range(0,len(id_slice)):
         im = ax[i].imshow(var[id_slice[i],:,:])
         ax[i].set_title(f'Slice: {id_slice[i]}')
         fig.colorbar(im, ax=ax[i])
+    for i in range(len(id_slice),len(ax)):
+        ax[i].set_visible(False)
     fig.suptitle(f'{title}')
 
 
@@ -5,13 +5,36 @@ Created on Tue Dec 12 13:41:12 2023
 @author: ANTHI182
 """
 
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
-import matplotlib.colors as colors
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat
+from pathlib import Path
 import numpy as np
-from scipy.stats import gaussian_kde
-import rasterio
-import pickle
+
+try:
+    from ._lazy import lazy_import
+    from . import footprint_utils
+    from .instrumentation import instrument, record
+except ImportError:
+    from _lazy import lazy_import
+    import footprint_utils
+    from instrumentation import instrument, record
+
+matplotlib = lazy_import('matplotlib')
+plt = lazy_import('matplotlib.pyplot')
+colors = lazy_import('matplotlib.colors')
+mdates = lazy_import('matplotlib.dates')
+mcollections = lazy_import('matplotlib.collections')
+pd = lazy_import('pandas')
+stats = lazy_import('scipy.stats')
+signal = lazy_import('scipy.signal')
+ndimage = lazy_import('scipy.ndimage')
+spatial = lazy_import('scipy.spatial')
+rasterio = lazy_import('rasterio')
+rasterio_enums = lazy_import('rasterio.enums')
+windows = lazy_import('rasterio.windows')
 
 def draw_linear_reg(reg, ax=None , X=None, c='C0', verb=False):
     """
@@ -36,11 +59,10 @@ def draw_linear_reg(reg, ax=None , X=None, c='C0', verb=False):
 
     """
     if X is not None:
-        mask = ~np.isnan(X) & np.isfinite(X)
         if np.ndim(X)==1:
-            X = X[mask,np.newaxis]
+            X = X[np.isfinite(X),np.newaxis]
         else:
-            X = X[mask,:]
+            X = X[np.isfinite(X).all(axis=1),:]
     else:
         if ax:
             X = np.array(ax.get_xlim())
@@ -56,6 +78,152 @@ def draw_linear_reg(reg, ax=None , X=None, c='C0', verb=False):
     return h
 
 
+def fit_linear_regs(x, y, groups):
+    """
+    Fit one simple linear regression y = intercept + slope * x per group,
+    all at once from grouped sums (no loop over the groups).
+
+    Parameters
+    ----------
+    x : Numpy array (n,)
+    y : Numpy array (n,)
+    groups : Numpy array (n,)
+        Label of the group (station, etc.) of each point
+
+    Returns
+    -------
+    fits : Pandas DataFrame
+        One row per group with n, slope, intercept, r2, x_mean, x_min,
+        x_max, sxx (sum of squared deviations of x) and s (standard
+        deviation of the residuals)
+    """
+    x, y, groups = np.asarray(x, dtype=float), np.asarray(y, dtype=float), np.asarray(groups)
+    mask = np.isfinite(x) & np.isfinite(y)
+    labels, g = np.unique(groups[mask], return_inverse=True)
+    x, y = x[mask], y[mask]
+    n_groups = len(labels)
+
+    def gsum(v):
+        return np.bincount(g, weights=v, minlength=n_groups)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n = np.bincount(g, minlength=n_groups).astype(float)
+        x_mean, y_mean = gsum(x) / n, gsum(y) / n
+        # Sums of the deviations to the group means. Expanding them into
+        # sums of squares cancels catastrophically for large offsets (e.g.
+        # x in epoch seconds)
+        dx, dy = x - x_mean[g], y - y_mean[g]
+        sxx = gsum(dx**2)
+        syy = gsum(dy**2)
+        sxy = gsum(dx*dy)
+        slope = sxy / sxx
+        ss_res = np.maximum(syy - slope * sxy, 0)
+        x_min = np.full(n_groups, np.inf)
+        x_max = np.full(n_groups, -np.inf)
+        np.minimum.at(x_min, g, x)
+        np.maximum.at(x_max, g, x)
+
+        return pd.DataFrame({
+            'n': n, 'slope': slope, 'intercept': y_mean - slope * x_mean,
+            'r2': 1 - ss_res / syy, 'x_mean': x_mean, 'x_min': x_min,
+            'x_max': x_max, 'sxx': sxx, 's': np.sqrt(ss_res / (n - 2))},
+            index=pd.Index(labels, name='group'))
+
+
+def draw_linear_regs(x=None, y=None, groups=None, models=None, ax=None,
+                     x_eval=None, ci=95, line_colors=None, n_points=50, alpha=0.2,
+                     linewidth=1):
+    """
+    Draw many linear regressions and their confidence bands as a single
+    LineCollection and a single PolyCollection. Regressions are either
+    fitted per group on (x, y) (see fit_linear_regs) or given as fitted
+    scikit learn linear models (lines only).
+
+    Parameters
+    ----------
+    x, y : Numpy arrays (n,), optional
+        Data to fit
+    groups : Numpy array (n,), optional
+        Label of the group of each point. One regression is fitted per
+        group. If not specified, a single regression is fitted.
+    models : List of sklearn linear regression objects, optional
+        Fitted models with one input variable, used instead of x and y
+    ax : Matplotlib axes, optional
+        If not specified, a new figure is created. The default is None.
+    x_eval : Tuple, optional
+        (min, max) of the x values where regressions are drawn. If not
+        specified, each regression is drawn over the range of its data (or
+        the current axis limits for models).
+    ci : Float, optional
+        Confidence level in percent of the band around the mean response.
+        None to draw no band. The default is 95.
+    line_colors : List of matplotlib colors, optional
+        Color of each regression. The default is the color cycle.
+    n_points : Int, optional
+        Number of points along each line (bands are curved). The default
+        is 50.
+    alpha : Float, optional
+        Transparency of the bands. The default is 0.2.
+    linewidth : Float, optional
+        Width of the lines. The default is 1.
+
+    Returns
+    -------
+    lines : Matplotlib LineCollection
+    bands : Matplotlib PolyCollection or None
+    fits : Pandas DataFrame or None
+        Fitted regressions (see fit_linear_regs), None if models are given
+    """
+    if not ax:
+        fig, ax = plt.subplots()
+
+    fits = None
+    if models is not None:
+        slope = np.array([np.ravel(m.coef_)[0] for m in models])
+        intercept = np.array([np.ravel(m.intercept_)[0] for m in models])
+        if x_eval is None:
+            x_eval = ax.get_xlim()
+        X = np.tile(np.linspace(*x_eval, n_points), (len(models), 1))
+        ci = None
+    else:
+        if groups is None:
+            groups = np.zeros(np.shape(x), dtype=int)
+        fits = fit_linear_regs(x, y, groups)
+        slope, intercept = fits['slope'].to_numpy(), fits['intercept'].to_numpy()
+        if x_eval is None:
+            X = np.linspace(fits['x_min'].to_numpy(), fits['x_max'].to_numpy(),
+                            n_points, axis=1)
+        else:
+            X = np.tile(np.linspace(*x_eval, n_points), (len(fits), 1))
+
+    n_regs = len(slope)
+    if line_colors is None:
+        line_colors = [f'C{i % 10}' for i in range(n_regs)]
+    Y = intercept[:,np.newaxis] + slope[:,np.newaxis] * X
+
+    lines = mcollections.LineCollection(np.stack((X, Y), axis=-1),
+                                        colors=line_colors, linewidths=linewidth)
+    ax.add_collection(lines)
+
+    bands = None
+    if ci is not None:
+        n = fits['n'].to_numpy()[:,np.newaxis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_value = stats.t.ppf(1 - (1 - ci/100) / 2, n - 2)
+            half_width = t_value * fits['s'].to_numpy()[:,np.newaxis] * np.sqrt(
+                1/n + (X - fits['x_mean'].to_numpy()[:,np.newaxis])**2
+                / fits['sxx'].to_numpy()[:,np.newaxis])
+        upper = np.stack((X, Y + half_width), axis=-1)
+        lower = np.stack((X, Y - half_width), axis=-1)[:,::-1,:]
+        bands = mcollections.PolyCollection(
+            np.concatenate((upper, lower), axis=1),
+            facecolors=line_colors, edgecolors='none', alpha=alpha)
+        ax.add_collection(bands)
+
+    ax.autoscale_view()
+    return lines, bands, fits
+
+
 def add_text_rp(text, x_rp, y_rp, ax=None, fontsize=10):
     """
     Add text at X, Y data relative position (in data coordinates)
@@ -88,34 +256,112 @@ def add_text_rp(text, x_rp, y_rp, ax=None, fontsize=10):
     return h
 
 
-def draw_quantile_boundaries(x, y, n_bins=10, quantile=(5,95), ax=None, c='C0'):
+@instrument()
+def binned_statistics(x, y, n_bins=10, quantiles=(5,95), bin_edges=None):
+    """
+    Compute statistics of y in bins of x (count, mean, median and
+    quantiles) in a single vectorized pass: bins are assigned once with
+    searchsorted and the data are sorted once by bin and by value.
 
-    mask = (
-        ~np.isnan(x) & np.isfinite(x) &
-        ~np.isnan(y) & np.isfinite(y)
-        )
+    Parameters
+    ----------
+    x : Numpy array (n,)
+        Data used to define the bins
+    y : Numpy array (n,)
+        Data on which the statistics are computed
+    n_bins : Int, optional
+        Number of bins, with edges at the quantiles of x (equally populated
+        bins). Ignored if bin_edges is specified. The default is 10.
+    quantiles : Tuple of float, optional
+        Quantiles to compute, in percent. The default is (5,95).
+    bin_edges : Numpy array, optional
+        Edges of the bins. The last bin includes its upper edge. The
+        default is None.
+
+    Returns
+    -------
+    df : Pandas DataFrame
+        One row per bin with columns bin_left, bin_right, bin_center, count,
+        mean, median and q<quantile> for each quantile (e.g. q5, q95)
+    """
+    mask = np.isfinite(x) & np.isfinite(y)
     x, y = x[mask], y[mask]
 
-    # Create histogram bins for 'x'
-    bin_edges = np.quantile(x, np.linspace(0,1,n_bins+1))
+    if bin_edges is None:
+        bin_edges = np.quantile(x, np.linspace(0,1,n_bins+1))
+    bin_edges = np.asarray(bin_edges)
+    n_bins = len(bin_edges) - 1
+
+    # Assign bins once. The last bin includes its upper edge
+    bin_id = np.searchsorted(bin_edges, x, side='right') - 1
+    bin_id[x == bin_edges[-1]] = n_bins - 1
+    inside = (bin_id >= 0) & (bin_id < n_bins)
+    bin_id, y = bin_id[inside], y[inside]
+
+    # Sort once by bin, then by value
+    y_sorted = y[np.lexsort((y, bin_id))]
+    counts = np.bincount(bin_id, minlength=n_bins)
+    starts = np.cumsum(counts) - counts
+
+    # Quantiles of all bins at once, with linear interpolation (as np.percentile)
+    q = np.append(np.asarray(quantiles, dtype=float), 50) / 100
+    pos = starts[:,np.newaxis] + q[np.newaxis,:] * np.maximum(counts - 1, 0)[:,np.newaxis]
+    lo = np.floor(pos).astype(int)
+    hi = np.minimum(lo + 1, (starts + counts - 1)[:,np.newaxis])
+    frac = pos - lo
+    if y_sorted.size:
+        lo, hi = np.clip(lo, 0, y_sorted.size-1), np.clip(hi, 0, y_sorted.size-1)
+        q_values = y_sorted[lo] * (1 - frac) + y_sorted[hi] * frac
+    else:
+        q_values = np.zeros(pos.shape)
+    q_values[counts == 0, :] = np.nan
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.bincount(bin_id, weights=y, minlength=n_bins) / counts
 
-    # Initialize arrays to store quantile values
-    quantile_05_values = np.zeros(n_bins)
-    quantile_95_values = np.zeros(n_bins)
+    df = pd.DataFrame({
+        'bin_left': bin_edges[:-1],
+        'bin_right': bin_edges[1:],
+        'bin_center': (bin_edges[:-1] + bin_edges[1:]) / 2,
+        'count': counts,
+        'mean': mean,
+        'median': q_values[:,-1]})
+    for i, quantile in enumerate(quantiles):
+        df[f'q{quantile:g}'] = q_values[:,i]
+    return df
 
-    # Calculate quantile values for each bin
-    for i in range(n_bins):
-        indices_in_bin = np.where((x >= bin_edges[i]) & (x < bin_edges[i + 1]))
-        quantile_05_values[i] = np.percentile(y[indices_in_bin], quantile[0])
-        quantile_95_values[i] = np.percentile(y[indices_in_bin], quantile[1])
 
-    # Calculate the bin centers
-    bin_centers = [(bin_edges[i] + bin_edges[i + 1]) / 2 for i in range(len(bin_edges) - 1)]
+def draw_quantile_boundaries(x, y, n_bins=10, quantile=(5,95), ax=None, c='C0'):
+    """
+    Draw the quantiles of y computed in bins of x (see binned_statistics).
+
+    Parameters
+    ----------
+    x : Numpy array (n,)
+        Data used to define the bins
+    y : Numpy array (n,)
+        Data on which the quantiles are computed
+    n_bins : Int, optional
+        Number of equally populated bins. The default is 10.
+    quantile : Tuple of float, optional
+        Quantiles to draw, in percent. The default is (5,95).
+    ax : Matplotlib axes, optional
+        If not specified, a new figure is created. The default is None.
+    c : String, optional
+        Matplotlib color code. The default is 'C0'.
+
+    Returns
+    -------
+    h : List of Matplotlib line objects
+        One line per quantile
+    """
+    df = binned_statistics(x, y, n_bins=n_bins, quantiles=quantile)
 
     if not ax:
         fig, ax = plt.subplots()
-    ax.plot(bin_centers, quantile_05_values, color=c)
-    ax.plot(bin_centers, quantile_95_values, color=c)
+    h = [ax.plot(df['bin_center'], df[f'q{q:g}'], color=c)[0]
+         for q in quantile]
+    return h
 
 
 def draw_identity_line(ax, color='k'):
@@ -138,7 +384,87 @@ def draw_identity_line(ax, color='k'):
     return l
 
 
-def density_scatter_plot(x, y, ax=None, s=50, cmap='viridis', hexbin=False):
+@instrument()
+def point_density(x, y, method='hist', bins=256):
+    """
+    Estimate the density of the points (x, y) at each point.
+
+    Parameters
+    ----------
+    x : Numpy array (n,)
+        x data (finite values)
+    y : Numpy array (n,)
+        y data (finite values)
+    method : String, optional
+        'kde' : exact gaussian kernel density estimate (scipy gaussian_kde).
+            Cost O(n^2), only suitable for small datasets.
+        'hist' : 2-D histogram smoothed with a gaussian kernel (FFT
+            convolution) and interpolated back to the points. Cost O(n).
+            The grid covers the 0.1-99.9 percentiles of the data, isolated
+            spikes further away get a density of about 0.
+        'knn' : number of neighbours within one bandwidth, using a KD-tree.
+            Cost O(n log n) plus the number of neighbours, which grows with
+            n for dense datasets.
+        The bandwidth of 'hist' and 'knn' follows Scott's rule with the
+        covariance of the data, as gaussian_kde. The default is 'hist'.
+    bins : Int, optional
+        Number of bins on each axis for the 'hist' method. The default is 256.
+
+    Returns
+    -------
+    z : Numpy array (n,)
+        Density at each point
+    """
+    n = x.shape[0]
+    record(rows=n)
+    if method == 'kde':
+        xy = np.vstack([x,y])
+        return stats.gaussian_kde(xy)(xy)
+
+    # Work in whitened coordinates where the kernel is a unit gaussian. The
+    # bandwidth follows Scott's rule with the data covariance, as gaussian_kde
+    L = np.linalg.cholesky(np.cov(x, y) + np.eye(2) * 1e-12) * n ** (-1/6)
+    u, v = np.linalg.solve(L, np.vstack([x,y]))
+    det = np.linalg.det(L)
+
+    match method:
+        case 'hist':
+            # Histogram over the central range of the data padded by the
+            # kernel size. Spikes outside of it would stretch the grid until
+            # the kernel is smaller than a bin; they are left out and get
+            # the density of the edge of the grid (about 0)
+            qu = np.percentile(u, [0.1, 99.9])
+            qv = np.percentile(v, [0.1, 99.9])
+            range_uv = [[qu[0] - 4, qu[1] + 4], [qv[0] - 4, qv[1] + 4]]
+            H, u_edges, v_edges = np.histogram2d(u, v, bins=bins, range=range_uv)
+            du, dv = u_edges[1] - u_edges[0], v_edges[1] - v_edges[0]
+
+            # Separable gaussian kernel sampled on the bins
+            gu = np.arange(-np.ceil(4/du), np.ceil(4/du) + 1) * du
+            gv = np.arange(-np.ceil(4/dv), np.ceil(4/dv) + 1) * dv
+            kernel = np.outer(np.exp(-gu**2/2), np.exp(-gv**2/2))
+            kernel /= kernel.sum()
+            density = signal.fftconvolve(H, kernel, mode='same') / (n * du * dv * det)
+
+            # Bilinear interpolation of the density at the points
+            iu = (u - u_edges[0]) / du - 0.5
+            iv = (v - v_edges[0]) / dv - 0.5
+            z = ndimage.map_coordinates(density, [iu, iv], order=1, mode='nearest')
+            return np.maximum(z, 0)
+
+        case 'knn':
+            # Number of neighbours within one bandwidth
+            uv = np.column_stack([u, v])
+            counts = spatial.cKDTree(uv).query_ball_point(uv, r=1, return_length=True)
+            return counts / (n * np.pi * det)
+
+        case _:
+            raise ValueError(f'Unknown density method {method}')
+
+
+@instrument()
+def density_scatter_plot(x, y, ax=None, s=50, cmap='viridis', hexbin=False,
+                         density='kde'):
     """
     Make a scatter plot that renders the density of the points with a color
     scheme.
@@ -159,6 +485,10 @@ def density_scatter_plot(x, y, ax=None, s=50, cmap='viridis', hexbin=False):
     hexbin : Bool, optional
         Switches to pyplot hexbin plot instead of scatter. Appropriate for
         very large dataset.
+    density : String, optional
+        Method used to compute the density of the points: 'kde' (exact,
+        slow for large datasets), 'hist' or 'knn' (fast approximations for
+        large datasets). See point_density. The default is 'kde'.
 
     Returns
     -------
@@ -179,8 +509,7 @@ def density_scatter_plot(x, y, ax=None, s=50, cmap='viridis', hexbin=False):
         return h
 
     # Calculate the point density
-    xy = np.vstack([x,y])
-    z = gaussian_kde(xy)(xy)
+    z = point_density(x, y, method=density)
 
     # Sort the points by density, so that the densest points are plotted last
     idx = z.argsort()
@@ -191,7 +520,31 @@ def density_scatter_plot(x, y, ax=None, s=50, cmap='viridis', hexbin=False):
     return h
 
 
-def make_iterable_subplots(iterable, figsize=(6,4)):
+def subplot_grid(n_panels, aspect=1.):
+    """
+    Compute the number of rows and columns of a grid of subplots.
+
+    Parameters
+    ----------
+    n_panels : Int
+        Number of panels
+    aspect : Float, optional
+        Targeted ratio of the number of columns to the number of rows. The
+        default is 1 (square grid).
+
+    Returns
+    -------
+    nrows : Int
+    ncols : Int
+    """
+    n_panels = max(1, int(n_panels))
+    nrows = max(1, int(np.sqrt(n_panels / aspect)))
+    ncols = int(np.ceil(n_panels / nrows))
+    nrows = int(np.ceil(n_panels / ncols))
+    return nrows, ncols
+
+
+def make_iterable_subplots(iterable, figsize=(6,4), aspect=1.):
     """
     Create a figure with an ideal number of subplots to represent each element
     of an iterable variable. It returns a set of axes for each subplot that
@@ -202,6 +555,9 @@ def make_iterable_subplots(iterable, figsize=(6,4)):
     iterable : Iterable object (list, array, etc)
     figsize : Tuple, optional
         Size of the figure. The default is (6,4).
+    aspect : Float, optional
+        Targeted ratio of the number of columns to the number of rows (see
+        subplot_grid). The default is 1.
 
     Returns
     -------
@@ -209,13 +565,148 @@ def make_iterable_subplots(iterable, figsize=(6,4)):
     ax : Matplotlib list of axes
 
     """
-    nrows = len(iterable) // np.sqrt(len(iterable))
-    ncols = np.ceil(len(iterable) / nrows)
-    fig, ax = plt.subplots(int(nrows),int(ncols), figsize=figsize)
+    nrows, ncols = subplot_grid(len(iterable), aspect)
+    fig, ax = plt.subplots(nrows, ncols, figsize=figsize)
     ax = np.ravel(ax)
     return fig, ax
 
 
+class PanelGrid():
+    """
+    Grid of image panels that is created once and updated in place. Redraws
+    only replace the data of the images, they do not recreate the axes, so
+    the same figure can show many successive sets of panels.
+
+    Parameters
+    ----------
+    n_panels : Int
+        Number of panels of the grid
+    figsize : Tuple, optional
+        Size of the figure. The default is (6,4).
+    aspect : Float, optional
+        Targeted ratio of the number of columns to the number of rows (see
+        subplot_grid). The default is 1.
+    colorbar : Bool, optional
+        Add a colorbar to each panel. The default is False.
+    **kwargs :
+        Parameters passed to imshow
+    """
+
+    def __init__(self, n_panels, figsize=(6,4), aspect=1., colorbar=False, **kwargs):
+        self.fig, self.ax = make_iterable_subplots(range(n_panels), figsize, aspect)
+        self.colorbar = colorbar
+        self.kwargs = kwargs
+        self.images = [None] * len(self.ax)
+        for ax in self.ax[n_panels:]:
+            ax.set_visible(False)
+
+    def update(self, images, titles=None, suptitle=None):
+        """
+        Show a set of images in the panels.
+
+        Parameters
+        ----------
+        images : List of 2-D arrays
+            Images to show, at most one per panel. Panels without image are
+            hidden.
+        titles : List of String, optional
+            Title of each panel. The default is None.
+        suptitle : String, optional
+            Title of the figure. The default is None.
+        """
+        for i, ax in enumerate(self.ax):
+            if i >= len(images):
+                ax.set_visible(False)
+                continue
+            ax.set_visible(True)
+            data = images[i]
+            if self.images[i] is None:
+                self.images[i] = ax.imshow(data, **self.kwargs)
+                if self.colorbar:
+                    self.fig.colorbar(self.images[i], ax=ax)
+            else:
+                shape = self.images[i].get_array().shape[:2]
+                self.images[i].set_data(data)
+                if np.shape(data)[:2] != shape and 'extent' not in self.kwargs:
+                    # Default extent of imshow for the new shape
+                    ny, nx = np.shape(data)[:2]
+                    if self.images[i].origin == 'lower':
+                        self.images[i].set_extent((-0.5, nx - 0.5, -0.5, ny - 0.5))
+                    else:
+                        self.images[i].set_extent((-0.5, nx - 0.5, ny - 0.5, -0.5))
+                if 'vmin' not in self.kwargs and 'norm' not in self.kwargs:
+                    self.images[i].autoscale()
+            if titles is not None:
+                ax.set_title(titles[i])
+        if suptitle is not None:
+            self.fig.suptitle(suptitle)
+        self.fig.canvas.draw_idle()
+
+
+def _save_panel_pages(pages, output_dir, panels_per_page, fmt, dpi, kwargs):
+    """ Render pages of panels with a single PanelGrid and save them."""
+    grid = PanelGrid(panels_per_page, **kwargs)
+    output_files = []
+    for i_page, images, titles in pages:
+        grid.update(images, titles, suptitle=f'Page {i_page + 1}')
+        output_file = Path(output_dir).joinpath(f'page_{i_page:04d}.{fmt}')
+        grid.fig.savefig(output_file, dpi=dpi)
+        output_files.append(output_file)
+    plt.close(grid.fig)
+    return output_files
+
+
+def save_panel_pages(images, output_dir, panels_per_page=16, titles=None,
+                     fmt='png', dpi=100, n_jobs=None, **kwargs):
+    """
+    Render many image panels as pages of subplots saved to files. Pages are
+    split between worker processes, and each worker reuses a single figure
+    for all its pages (see PanelGrid).
+
+    Parameters
+    ----------
+    images : List of 2-D arrays
+        Images to show, one per panel
+    output_dir : String or Pathlib Path
+        Directory where the pages are saved (page_0000.png, ...)
+    panels_per_page : Int, optional
+        Number of panels per page. The default is 16.
+    titles : List of String, optional
+        Title of each panel. The default is None.
+    fmt : String, optional
+        Format of the files. The default is 'png'.
+    dpi : Float, optional
+        Resolution of the files. The default is 100.
+    n_jobs : Int, optional
+        Number of worker processes. The default is None (number of CPUs).
+    **kwargs :
+        Parameters passed to PanelGrid (figsize, aspect, colorbar, imshow
+        parameters)
+
+    Returns
+    -------
+    output_files : List of Pathlib Path
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    pages = [(i // panels_per_page,
+              images[i:i + panels_per_page],
+              None if titles is None else titles[i:i + panels_per_page])
+             for i in range(0, len(images), panels_per_page)]
+
+    n_workers = min(n_jobs or os.cpu_count(), len(pages))
+    if n_workers <= 1:
+        return _save_panel_pages(pages, output_dir, panels_per_page, fmt, dpi, kwargs)
+
+    chunks = [[pages[i] for i in chunk]
+              for chunk in np.array_split(np.arange(len(pages)), n_workers)]
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             initializer=_init_batch_worker) as executor:
+        results = executor.map(_save_panel_pages, chunks, repeat(output_dir),
+                               repeat(panels_per_page), repeat(fmt),
+                               repeat(dpi), repeat(kwargs))
+    return [f for files in results for f in files]
+
+
 def plot_histogram(bin_edges, bin_counts, ax = None, width=1, color='b', alpha=0.7, edgecolor='black'):
     """
     Plot histogram from bin_edges and bin_counts using matplotlib.pyplot.bar
@@ -245,17 +736,201 @@ def plot_histogram(bin_edges, bin_counts, ax = None, width=1, color='b', alpha=0
     """
     if not ax:
         fig, ax = plt.subplots()
-    bin_centers = [(bin_edges[i] + bin_edges[i+1]) / 2 for i in range(len(bin_edges)-1)]
+    else:
+        fig = ax.figure
+    bin_edges = np.asarray(bin_edges)
+    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
     ax.bar(bin_centers, bin_counts,
-           width=(bin_edges[1]-bin_edges[0])*width,
+           width=np.diff(bin_edges)*width,
            color=color, alpha=alpha, edgecolor=edgecolor)
     return fig, ax
 
 
+class HistogramAccumulator():
+    """
+    Histogram updated chunk by chunk, for datasets too large to be loaded
+    at once (CSV files, raster windows, NetCDF slices, etc.). It can be
+    plotted at any time with plot_histogram.
+
+    Two modes are available:
+        - fixed edges (uniform or not) given by bin_edges. Values outside of
+          the edges are counted in n_outside.
+        - adaptive uniform bins of width given by the range of the first
+          chunk divided by bins. Bins are added when new values fall outside
+          of the current edges and pairs of bins are merged when there are
+          more than max_bins bins, so that no value is ever dropped.
+
+    Parameters
+    ----------
+    bins : Int, optional
+        Number of bins used on the range of the first chunk in adaptive
+        mode. The default is 10.
+    bin_edges : Array, optional
+        Fixed edges of the bins. The default is None (adaptive mode).
+    max_bins : Int, optional
+        Maximum number of bins in adaptive mode. The default is 1000.
+    """
+
+    def __init__(self, bins=10, bin_edges=None, max_bins=1000):
+        self.bins = bins
+        self.max_bins = max_bins
+        self.n_outside = 0
+        self.fixed = bin_edges is not None
+        if self.fixed:
+            self.bin_edges = np.asarray(bin_edges, dtype=float)
+            self.counts = np.zeros(len(self.bin_edges) - 1)
+        else:
+            self.bin_edges = None
+            self.counts = None
+
+    def _extend(self, vmin, vmax):
+        """ Add bins so that [vmin, vmax] is covered, then merge pairs of
+        bins while there are too many."""
+        if self.bin_edges is None:
+            width = (vmax - vmin) / self.bins if vmax > vmin else 1.
+            self.origin, self.width = vmin, width
+            self.counts = np.zeros(self.bins)
+        n_below = int(max(0, np.ceil((self.origin - vmin) / self.width)))
+        n_above = int(max(0, np.floor((vmax - self.origin) / self.width) + 1
+                          - len(self.counts)))
+        if n_below or n_above:
+            self.counts = np.concatenate(
+                (np.zeros(n_below), self.counts, np.zeros(n_above)))
+            self.origin -= n_below * self.width
+        while len(self.counts) > self.max_bins:
+            if len(self.counts) % 2:
+                self.counts = np.append(self.counts, 0)
+            self.counts = self.counts.reshape(-1, 2).sum(axis=1)
+            self.width *= 2
+        self.bin_edges = self.origin + self.width * np.arange(len(self.counts) + 1)
+
+    def update(self, data, weights=None):
+        """
+        Add a chunk of data to the histogram.
+
+        Parameters
+        ----------
+        data : Array
+            Chunk of data, of any shape. Masked and non finite values are
+            ignored.
+        weights : Array, optional
+            Weight of each value, same shape as data. The default is None.
+        """
+        data = np.ma.asarray(data).astype(float).filled(np.nan).ravel()
+        mask = np.isfinite(data)
+        if weights is not None:
+            weights = np.ma.asarray(weights).astype(float).filled(np.nan).ravel()
+            mask &= np.isfinite(weights)
+            weights = weights[mask]
+        data = data[mask]
+        if data.size == 0: return
+
+        if self.fixed:
+            counts, _ = np.histogram(data, bins=self.bin_edges, weights=weights)
+            inside = (data >= self.bin_edges[0]) & (data <= self.bin_edges[-1])
+            self.n_outside += np.count_nonzero(~inside)
+            self.counts += counts
+            return
+
+        self._extend(data.min(), data.max())
+        idx = ((data - self.origin) // self.width).astype(int)
+        idx = np.clip(idx, 0, len(self.counts) - 1)
+        self.counts += np.bincount(idx, weights=weights, minlength=len(self.counts))
+
+    def update_from_csv(self, csv_file, column, chunksize=100_000, **kwargs):
+        """ Add a column of a CSV file, read by chunks of chunksize rows.
+        Other parameters are passed to pandas.read_csv."""
+        for chunk in pd.read_csv(csv_file, usecols=[column],
+                                 chunksize=chunksize, **kwargs):
+            self.update(pd.to_numeric(chunk[column], errors='coerce').to_numpy())
+
+    def update_from_raster(self, raster_file, band=1):
+        """ Add a band of a raster, read block by block. Nodata values are
+        ignored."""
+        with rasterio.open(raster_file) as src:
+            for _, window in src.block_windows(band):
+                self.update(src.read(band, window=window, masked=True))
+
+    def plot(self, ax=None, **kwargs):
+        """ Plot the histogram (see plot_histogram)."""
+        if self.bin_edges is None:
+            raise ValueError('No data has been added to the histogram')
+        return plot_histogram(self.bin_edges, self.counts, ax=ax, **kwargs)
+
+
+@lru_cache(maxsize=16)
+def _read_background_map(background_map, bounds, out_size):
+    """ Cached implementation of read_background_map (hashable arguments)."""
+    with rasterio.open(background_map) as src:
+        full_window = windows.Window(0, 0, src.width, src.height)
+        window = full_window
+        if bounds is not None:
+            window = windows.from_bounds(*bounds, transform=src.transform)
+            try:
+                window = window.round_offsets().round_lengths().intersection(
+                    full_window)
+            except rasterio.errors.WindowError:
+                # The window is outside of the map, show the whole map
+                window = full_window
+
+        # Never read more pixels than displayed. Decimated reads use the
+        # GeoTIFF overviews when they exist.
+        scale = 1
+        if out_size is not None:
+            scale = min(1, out_size[0] / window.width, out_size[1] / window.height)
+        out_shape = (src.count,
+                     max(1, int(round(window.height * scale))),
+                     max(1, int(round(window.width * scale))))
+
+        background = src.read(window=window, out_shape=out_shape,
+                              resampling=rasterio_enums.Resampling.bilinear)
+        left, bottom, right, top = windows.bounds(window, src.transform)
+
+    background = np.moveaxis(background, 0, -1)
+    if background.shape[-1] == 1:
+        background = background[:,:,0]
+    return background, [left, right, bottom, top]
+
+
+@instrument()
+def read_background_map(background_map, bounds=None, out_size=None):
+    """
+    Read a georeferenced map, restricted to a window and at the resolution
+    needed for display. Results are cached per map, window and resolution.
+
+    Parameters
+    ----------
+    background_map : String or Pathlib Path
+        Path to the map file
+    bounds : Tuple, optional
+        (left, bottom, right, top) of the window to read, in the map
+        projection system. If not specified, or if the window does not
+        overlap the map, the whole map is read.
+    out_size : Tuple, optional
+        (width, height) in pixels of the displayed image. The map is read at
+        this resolution if it is finer. If not specified, the map is read
+        at full resolution.
+
+    Returns
+    -------
+    background : Numpy array (height, width, bands) or (height, width)
+        Map data
+    extent : List
+        [left, right, bottom, top] of the data read, for imshow
+    """
+    if bounds is not None:
+        bounds = tuple(float(b) for b in bounds)
+    if out_size is not None:
+        out_size = tuple(int(s) for s in out_size)
+    return _read_background_map(str(background_map), bounds, out_size)
+
+
+@instrument()
 def plot_footprint_over_map(footprint, background_map, coordinates,
-                            show_heatmap=True, heatmap_colormap=cm.jet, normalize_colormap=False,
+                            show_heatmap=True, heatmap_colormap='jet', normalize_colormap=False,
                             contour_line_width=0.5, contour_line_color = 'k',
-                            iso_labels=False, iso_label_size=8):
+                            iso_labels=False, iso_label_size=8,
+                            map_margin=0, figsize=(10, 8), verb=False, show=True):
     """
     Plot the footprint computed by the Kljun method over a georeferenced map.
     The map should be projected and have meters for units.
@@ -266,23 +941,25 @@ def plot_footprint_over_map(footprint, background_map, coordinates,
 
     Parameters
     ----------
-    footprint : Dictionary
-        Dictionary as provided by the Kljun algorithm. Must contain the
-        following fields:
+    footprint : Dictionary, String or Pathlib Path
+        Dictionary as provided by the Kljun algorithm, or path to a pickled
+        dictionary or to a NPZ footprint file (see
+        footprint_utils.load_footprint). Must contain the following fields:
             x_2d	    = x-grid of 2-dimensional footprint [m]
             y_2d	    = y-grid of 2-dimensional footprint [m]
             fclim_2d = Normalised footprint function values of footprint climatology [m-2]
             rs       = Percentage of footprint as in input, if provided
             fr       = Footprint value at rs, with rs the percentage of footprint as in inputif r is provided
-    background_map : String or Pathlib Path
-        Path to the map file
+    background_map : String, Pathlib Path or Tuple
+        Path to the map file, or map already read as (background, extent)
+        (see read_background_map)
     coordinates : Tuple
         Coordinates (longitude, latitude) in meters in the map projection
         system of the center of the footprint (location of the station)
 
     show_heatmap : Bool, optional
-    heatmap_colormap : Matplotlib.pyplot colormap, optional
-        The default is cm.jet.
+    heatmap_colormap : Matplotlib colormap or colormap name, optional
+        The default is 'jet'.
     normalize_colormap : String, optional
         Normalize the colors for the heatmap. Can be False, 'log', 'power'
         and 'boundaries'. The default is False.
@@ -297,6 +974,19 @@ def plot_footprint_over_map(footprint, background_map, coordinates,
     iso_label_size : Float, optional
         Size of the iso contours labels. The default is 8.
 
+    map_margin : Float or None, optional
+        Margin in meters around the footprint grid. Only this window of the
+        map is read, at the resolution of the figure (see
+        read_background_map), and shown. If None, the whole map is shown.
+        The default is 0.
+    figsize : Tuple, optional
+        Size of the figure. The default is (10, 8).
+    verb : Bool, optional
+        Verbose. Print the time spent reading the map and rendering the
+        figure. The default is False.
+    show : Bool, optional
+        Call plt.show() at the end. The default is True.
+
     Returns
     -------
     fig : TYPE
@@ -307,8 +997,7 @@ def plot_footprint_over_map(footprint, background_map, coordinates,
     """
 
     # Load footprint data
-    with open(footprint, 'rb') as f:
-        footprint_dict = pickle.load(f)
+    footprint_dict = footprint_utils.load_footprint(footprint)
 
     x_2d = footprint_dict['x_2d'] + coordinates[0]
     y_2d = footprint_dict['y_2d'] + coordinates[1]
@@ -318,15 +1007,32 @@ def plot_footprint_over_map(footprint, background_map, coordinates,
         np.max(fs)
         ))
 
-    # Read the GeoTIFF file
-    with rasterio.open(background_map) as src:
-        background = src.read()
-        background = np.moveaxis(background, 0, -1)
-        extent = [src.bounds.left, src.bounds.right, src.bounds.bottom, src.bounds.top]
-
     # Initialize figure
-    fig, ax = plt.subplots(figsize=(10, 8))
+    fig, ax = plt.subplots(figsize=figsize)
+
+    # Read the GeoTIFF file, around the footprint and at the figure resolution
+    t_start = time.perf_counter()
+    bounds = None
+    if map_margin is not None:
+        bounds = (x_2d.min() - map_margin, y_2d.min() - map_margin,
+                  x_2d.max() + map_margin, y_2d.max() + map_margin)
+    preloaded = isinstance(background_map, tuple)
+    if preloaded:
+        background, extent = background_map
+    else:
+        out_size = fig.get_size_inches() * fig.dpi
+        background, extent = read_background_map(background_map, bounds, out_size)
+    t_read = time.perf_counter()
+
     ax.imshow(background,extent=extent)
+    if preloaded and bounds is not None:
+        # The map may have been read for several footprints, only show the
+        # window of this one
+        xlim = (max(bounds[0], extent[0]), min(bounds[2], extent[1]))
+        ylim = (max(bounds[1], extent[2]), min(bounds[3], extent[3]))
+        if xlim[0] < xlim[1] and ylim[0] < ylim[1]:
+            ax.set_xlim(xlim)
+            ax.set_ylim(ylim)
 
     match normalize_colormap:
         case 'log':
@@ -338,23 +1044,333 @@ def plot_footprint_over_map(footprint, background_map, coordinates,
         case _:
             norm = None
 
-    if show_heatmap:
+    # No contour can be drawn if the grid contains none of the fractions rs
+    has_levels = len(clevs) > 1
+    if show_heatmap and has_levels:
         ax.contourf(x_2d, y_2d, fs, clevs, alpha = 0.5, cmap = heatmap_colormap,
                            norm=norm)
     # Show contour
-    ctr = ax.contour(x_2d, y_2d, fs, clevs, colors = contour_line_color, linewidths=contour_line_width)
+    if has_levels:
+        ctr = ax.contour(x_2d, y_2d, fs, clevs, colors = contour_line_color, linewidths=contour_line_width)
 
     #Isopleth Labels
-    if iso_labels:
+    if iso_labels and has_levels:
         pers = [str(int(clev*100))+'%' for clev in footprint_dict['rs'][::-1]]
         fmt = {}
         for l,s in zip(ctr.levels, pers):
             fmt[l] = s
         plt.clabel(ctr, fmt=fmt, inline=True, fontsize=iso_label_size)
-    plt.show()
+
+    if verb:
+        fig.canvas.draw()
+        t_render = time.perf_counter()
+        print(f'Background map read in {t_read - t_start:.2f} s, '
+              f'figure rendered in {t_render - t_read:.2f} s')
+    if show:
+        plt.show()
     return fig, ax
 
 
+# Maps read by batch_plot_footprints, {path: (background, extent)}, set in
+# the worker processes by _init_batch_worker
+_batch_backgrounds = {}
+
+
+def _init_batch_worker(backgrounds=None):
+    """ Use a non-interactive backend in the batch worker processes, and
+    keep the maps read by the parent process."""
+    global _batch_backgrounds
+    matplotlib.use('Agg')
+    _batch_backgrounds = backgrounds or {}
+
+
+def _batch_map_reads(footprints, background_maps, coordinates, dpi,
+                     map_margin=0, figsize=(10, 8)):
+    """ Window and resolution of each map to read once for all the
+    footprints plotted over it, as {path: (bounds, out_size)}."""
+    windows_by_map = {}
+    for footprint, background_map, coords in zip(footprints, background_maps,
+                                                 coordinates):
+        key = str(background_map)
+        if map_margin is None:
+            windows_by_map[key] = None
+            continue
+        footprint_dict = footprint_utils.load_footprint(footprint)
+        x_2d = footprint_dict['x_2d'] + coords[0]
+        y_2d = footprint_dict['y_2d'] + coords[1]
+        bounds = (x_2d.min() - map_margin, y_2d.min() - map_margin,
+                  x_2d.max() + map_margin, y_2d.max() + map_margin)
+        windows_by_map.setdefault(key, []).append(bounds)
+
+    out_size = np.asarray(figsize) * dpi
+    reads = {}
+    for key, bounds in windows_by_map.items():
+        if bounds is None:
+            reads[key] = (None, tuple(out_size))
+            continue
+        bounds = np.array(bounds)
+        union = (bounds[:,0].min(), bounds[:,1].min(),
+                 bounds[:,2].max(), bounds[:,3].max())
+        # The smallest footprint window still gets the resolution of the
+        # saved figure
+        width = (bounds[:,2] - bounds[:,0]).min()
+        height = (bounds[:,3] - bounds[:,1]).min()
+        scale = ((union[2] - union[0]) / width, (union[3] - union[1]) / height)
+        reads[key] = (union, tuple(out_size * scale))
+    return reads
+
+
+def _plot_footprint_to_file(footprint, background_map, coordinates,
+                            output_file, dpi, plot_kwargs):
+    """ Plot a footprint over a map and save the figure to a file."""
+    if not isinstance(background_map, tuple):
+        background_map = _batch_backgrounds.get(str(background_map),
+                                                background_map)
+    fig, ax = plot_footprint_over_map(footprint, background_map, coordinates,
+                                      show=False, **plot_kwargs)
+    fig.savefig(output_file, dpi=dpi)
+    plt.close(fig)
+    return output_file
+
+
+@instrument()
+def batch_plot_footprints(footprints, background_maps, coordinates, output_dir,
+                          fmt='png', dpi=150, n_jobs=None, **kwargs):
+    """
+    Plot many footprints over maps and save the figures to files, in
+    parallel worker processes using a non-interactive backend.
+
+    Each map is read once in the current process, over the window of all
+    the footprints plotted over it and at the resolution of the saved
+    figures, and shared with the workers.
+
+    Parameters
+    ----------
+    footprints : List of String or Pathlib Path
+        Footprint files (see plot_footprint_over_map)
+    background_maps : String, Pathlib Path or list of those
+        Map of all footprints, or one map per footprint
+    coordinates : Tuple or list of tuples
+        Coordinates (longitude, latitude) of the station of all footprints,
+        or one per footprint
+    output_dir : String or Pathlib Path
+        Directory where figures are saved, named after the footprint files.
+        Footprint files with the same name are prefixed by the name of
+        their folder (station_A_2023_06.png), or else suffixed by their
+        index in footprints.
+    fmt : String, optional
+        Format of the figures. The default is 'png'.
+    dpi : Float, optional
+        Resolution of the figures. The default is 150.
+    n_jobs : Int, optional
+        Number of worker processes. If 1, figures are produced in the
+        current process. The default is None (number of CPUs).
+    **kwargs :
+        Other parameters passed to plot_footprint_over_map
+
+    Returns
+    -------
+    output_files : List of Pathlib Path
+        Figure files, in the order of footprints
+    """
+    n = len(footprints)
+    if isinstance(background_maps, (str, Path)):
+        background_maps = [background_maps] * n
+    if np.ndim(coordinates) == 1:
+        coordinates = [tuple(coordinates)] * n
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    names = [Path(f).stem for f in footprints]
+    if len(set(names)) < n:
+        names = [f'{Path(f).parent.name}_{Path(f).stem}' for f in footprints]
+    if len(set(names)) < n:
+        names = [f'{name}_{i}' for i, name in enumerate(names)]
+    output_files = [output_dir.joinpath(f'{name}.{fmt}') for name in names]
+
+    reads = _batch_map_reads(footprints, background_maps, coordinates, dpi,
+                             kwargs.get('map_margin', 0),
+                             kwargs.get('figsize', (10, 8)))
+    backgrounds = {key: read_background_map(key, bounds, out_size)
+                   for key, (bounds, out_size) in reads.items()}
+
+    order = sorted(range(n), key=lambda i: (str(background_maps[i]),
+                                            tuple(coordinates[i])))
+    tasks = [[footprints[i] for i in order],
+             [background_maps[i] for i in order],
+             [coordinates[i] for i in order],
+             [output_files[i] for i in order],
+             [dpi] * n,
+             [kwargs] * n]
+
+    if n_jobs == 1:
+        tasks[1] = [backgrounds[str(m)] for m in tasks[1]]
+        list(map(_plot_footprint_to_file, *tasks))
+    else:
+        n_workers = n_jobs or os.cpu_count()
+        chunksize = max(1, n // (4 * n_workers))
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 initializer=_init_batch_worker,
+                                 initargs=(backgrounds,)) as executor:
+            list(executor.map(_plot_footprint_to_file, *tasks,
+                              chunksize=chunksize))
+    return output_files
+
+
+def decimate_minmax(y, n_buckets):
+    """
+    Indices of the minimum and maximum of y in n_buckets consecutive
+    buckets. Plotting only these points gives the same image as plotting
+    all the points when there is one bucket per pixel.
+
+    Parameters
+    ----------
+    y : Numpy array (n,)
+        Data (NaN are ignored)
+    n_buckets : Int
+        Number of buckets, typically the width of the axis in pixels
+
+    Returns
+    -------
+    idx : Numpy array
+        Sorted indices of the points to plot
+    """
+    n = y.shape[0]
+    n_buckets = max(1, int(n_buckets))
+    if n <= 2 * n_buckets:
+        return np.arange(n)
+
+    size = int(np.ceil(n / n_buckets))
+    n_buckets = int(np.ceil(n / size))
+    Y = np.full(n_buckets * size, np.nan)
+    Y[:n] = y
+    Y = Y.reshape(n_buckets, size)
+    valid = np.isfinite(Y)
+
+    i_min = np.argmin(np.where(valid, Y, np.inf), axis=1)
+    i_max = np.argmax(np.where(valid, Y, -np.inf), axis=1)
+    offset = np.arange(n_buckets) * size
+    idx = np.sort(np.column_stack((i_min, i_max)) + offset[:,np.newaxis], axis=1)
+    idx = idx[valid.any(axis=1)].ravel()
+    return np.unique(idx)
+
+
+class DecimatedTimeSeries():
+    """
+    Line of a long time series drawn from a min/max decimation of the data
+    to the width of the axis in pixels (see decimate_minmax). The line is
+    decimated again from the full data, which can be a memory-mapped array,
+    each time the x limits of the axis change (zoom, pan).
+
+    Parameters
+    ----------
+    t : Numpy array (n,)
+        Sorted time (numbers or datetime64)
+    y : Numpy array (n,)
+        Data, possibly memory-mapped (np.load(..., mmap_mode='r'))
+    ax : Matplotlib axes, optional
+        If not specified, a new figure is created. The default is None.
+    flags : Numpy array (n,), optional
+        Boolean flags or instrument diagnostic codes (diag_77, diag_irga,
+        diag_sonic) shown as markers over the line. Missing codes (NaN) are
+        not flagged. The default is None.
+    flag_mask : Int, optional
+        Bits of the diagnostic codes that are flagged. The default is None
+        (any non-zero code).
+    flag_color : String, optional
+        Color of the flag markers. The default is 'r'.
+    **kwargs :
+        Parameters passed to ax.plot
+    """
+
+    def __init__(self, t, y, ax=None, flags=None, flag_mask=None,
+                 flag_color='r', **kwargs):
+        if not ax:
+            fig, ax = plt.subplots()
+        self.ax = ax
+        self.t, self.y = t, y
+        self.is_date = np.issubdtype(np.asarray(t[:1]).dtype, np.datetime64)
+        self.flags = flags
+        self.flag_mask = flag_mask
+        self.line, = ax.plot(t[:1], y[:1], **kwargs)
+        self.flag_line = None
+        if flags is not None:
+            self.flag_line, = ax.plot(t[:1], y[:1], '|', color=flag_color)
+
+        ax.set_xlim(t[0], t[-1])
+        self.redraw()
+        y_valid = self.line.get_ydata()
+        y_valid = y_valid[np.isfinite(y_valid)]
+        if y_valid.size:
+            ax.set_ylim(y_valid.min(), y_valid.max())
+        ax.callbacks.connect('xlim_changed', lambda ax: self.redraw())
+
+    def _visible_slice(self):
+        xlim = self.ax.get_xlim()
+        if self.is_date:
+            xlim = [np.datetime64(mdates.num2date(x).replace(tzinfo=None))
+                    for x in xlim]
+        i0 = max(0, np.searchsorted(self.t, xlim[0]) - 1)
+        i1 = min(len(self.t), np.searchsorted(self.t, xlim[1]) + 1)
+        return i0, i1
+
+    def redraw(self):
+        """ Decimate the visible part of the data and update the line."""
+        i0, i1 = self._visible_slice()
+        n_pixels = self.ax.bbox.width
+        y = np.asarray(self.y[i0:i1], dtype=float)
+        idx = decimate_minmax(y, n_pixels)
+        t = np.asarray(self.t[i0:i1])
+        self.line.set_data(t[idx], y[idx])
+
+        if self.flag_line is not None:
+            flags = np.asarray(self.flags[i0:i1])
+            if flags.dtype != bool:
+                if not np.issubdtype(flags.dtype, np.integer):
+                    # Codes read with missing values are float, NaN is not flagged
+                    flags = np.asarray(flags, dtype=float)
+                    flags = np.where(np.isfinite(flags), flags, 0).astype(np.int64)
+                flags = (flags & self.flag_mask) != 0 if self.flag_mask \
+                    else flags != 0
+            # First flagged point of each pixel
+            i_flag = np.flatnonzero(flags)
+            bucket = i_flag * int(n_pixels) // max(1, len(flags))
+            i_flag = i_flag[np.unique(bucket, return_index=True)[1]]
+            self.flag_line.set_data(t[i_flag], y[i_flag])
+        self.ax.figure.canvas.draw_idle()
+
+
+def plot_timeseries(t, y, ax=None, flags=None, flag_mask=None, **kwargs):
+    """
+    Plot a long time series decimated to the width of the axis, with
+    optional diagnostic flags (see DecimatedTimeSeries).
+
+    Parameters
+    ----------
+    t : Numpy array (n,)
+        Sorted time (numbers or datetime64)
+    y : Numpy array (n,)
+        Data, possibly memory-mapped
+    ax : Matplotlib axes, optional
+        If not specified, a new figure is created. The default is None.
+    flags : Numpy array (n,), optional
+        Boolean flags or instrument diagnostic codes. The default is None.
+    flag_mask : Int, optional
+        Bits of the diagnostic codes that are flagged. The default is None
+        (any non-zero code).
+    **kwargs :
+        Parameters passed to ax.plot
+
+    Returns
+    -------
+    h : DecimatedTimeSeries
+        Object holding the line. It must be kept alive for the line to be
+        updated on zoom.
+    """
+    return DecimatedTimeSeries(t, y, ax=ax, flags=flags, flag_mask=flag_mask,
+                               **kwargs)
+
+
 def draw_whiskers(x_pos, y_pos, whisker_width=0.5, color='k', linewidth=1, ax=None):
     """
     Add text at X, Y data relative position (in data coordinates)